@@ -0,0 +1,98 @@
+""" Site: converts RA/dec to altitude/azimuth and back for an observing site,
+locally, so alt/az doesn't cost a round trip to the telescope.
+
+Angles are decimal degrees; azimuth runs from north (0) through east (90).
+Longitude is positive east of Greenwich.  Times are Unix timestamps, as from
+time.time().  No correction for refraction or precession is made: this is
+pointing accuracy, not astrometry."""
+
+import math
+import time
+
+import radec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None      # Only the array methods need numpy.
+
+def sidereal_degrees(when):
+    """Greenwich mean sidereal time, in degrees, at Unix time when (Meeus eq. 12.4)."""
+    d = when/86400.0 - 10957.5          # days since J2000.0
+    t = d/36525.0
+    return 280.46061837 + 360.98564736629*d + t*t*(0.000387933 - t/38710000.0)
+
+def _rotate(sin,cos,atan2,asin,sinlat,coslat,lat_deg,angle_deg):
+    """Rotate between the equatorial (dec, hour angle) and horizontal (alt, azimuth)
+    frames.  The transformation is its own inverse."""
+    lat = lat_deg*(math.pi/180)
+    angle = angle_deg*(math.pi/180)
+    sinl,cosl = sin(lat),cos(lat)
+    cosa = cos(angle)
+    x = -sin(angle)*cosl
+    y = sinl*coslat - cosl*cosa*sinlat
+    z = sinl*sinlat + cosl*cosa*coslat
+    return (asin(z)*(180/math.pi), (atan2(x,y)*(180/math.pi)) % 360)
+
+class Site:
+    """An observing site at latitude, longitude (decimal degrees, east positive).
+    clock() gives the current Unix time; it defaults to time.time, but can be
+    replaced for simulation or replaying a log."""
+
+    def __init__(self,latitude,longitude,clock=time.time):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.clock = clock
+        self.sinlat = math.sin(math.radians(latitude))
+        self.coslat = math.cos(math.radians(latitude))
+
+    def sidereal(self,when=None):
+        """Local sidereal time in decimal hours, at Unix time when (default: now)."""
+        if when is None:
+            when = self.clock()
+        return ((sidereal_degrees(when) + self.longitude) % 360)/15
+
+    def toAltAz(self,pos,when=None):
+        """Convert RADec object pos to an (altitude, azimuth) tuple at Unix time
+        when (default: now)."""
+        if when is None:
+            when = self.clock()
+        hourangle = sidereal_degrees(when) + self.longitude - 15*pos[0]
+        return _rotate(math.sin,math.cos,math.atan2,math.asin,self.sinlat,self.coslat,
+                       pos[1],hourangle)
+
+    def fromAltAz(self,alt,az,when=None):
+        """Convert altitude and azimuth to a RADec object at Unix time when
+        (default: now)."""
+        if when is None:
+            when = self.clock()
+        dec,hourangle = _rotate(math.sin,math.cos,math.atan2,math.asin,self.sinlat,self.coslat,
+                                alt,az)
+        ra = ((sidereal_degrees(when) + self.longitude - hourangle) % 360)/15
+        return radec.RADec((ra,dec))
+
+    def toAltAzArray(self,positions,when=None):
+        """Convert RADecArray positions to (altitude, azimuth) arrays.  when may be
+        a single Unix time or an array of them, one per position (default: now)."""
+        if numpy is None:
+            raise ImportError("toAltAzArray requires numpy.")
+        if when is None:
+            when = self.clock()
+        when = numpy.asarray(when,dtype=numpy.float64)
+        hourangle = sidereal_degrees(when) + self.longitude - 15*positions.ra()
+        return _rotate(numpy.sin,numpy.cos,numpy.arctan2,numpy.arcsin,self.sinlat,self.coslat,
+                       positions.dec(),hourangle)
+
+    def fromAltAzArray(self,alt,az,when=None):
+        """Convert altitude and azimuth arrays to a RADecArray.  when may be a
+        single Unix time or an array of them (default: now)."""
+        if numpy is None:
+            raise ImportError("fromAltAzArray requires numpy.")
+        if when is None:
+            when = self.clock()
+        when = numpy.asarray(when,dtype=numpy.float64)
+        dec,hourangle = _rotate(numpy.sin,numpy.cos,numpy.arctan2,numpy.arcsin,self.sinlat,self.coslat,
+                                numpy.asarray(alt,dtype=numpy.float64),
+                                numpy.asarray(az,dtype=numpy.float64))
+        ra = ((sidereal_degrees(when) + self.longitude - hourangle) % 360)/15
+        return radec.RADecArray(numpy.column_stack((ra,dec)))
@@ -0,0 +1,467 @@
+""" asyncio versions of the NexStar and Meade drivers.
+
+AsyncNexStar and AsyncMeade have the same methods as nexstar.NexStar and
+meade.Meade, but every method that talks to the scope is a coroutine.  Waiting
+for a slow or silent scope then doesn't hold up anything else, so one event
+loop can serve several scopes, Stellarium sockets and timers.
+
+    scope = asyncscope.AsyncNexStar()
+    await scope.open('/dev/ttyUSB0')
+    pos = await scope.getposition()
+"""
+
+import asyncio
+import platform
+
+import serial
+
+import meade
+import nexstar
+import radec
+import rateestimator
+import serialdev
+
+class AsyncSerial:
+    """A serial port that never blocks the event loop.  On Mac and Linux the
+    port's file descriptor is watched by the event loop; elsewhere, a worker
+    thread does the reading.  Reads without an explicit timeout use an adaptive
+    one, as serialdev.SerialPort does.  If the port fails (the scope is
+    unplugged), reading stops and every read or write from then on raises
+    serial.SerialException."""
+
+    def __init__(self,comport,baudrate=9600,timeout=1.0):
+        self.loop = asyncio.get_running_loop()
+        self.ser = serial.Serial(comport,baudrate,timeout=0)
+        self.bytetime = 10.0/baudrate
+        self.rtt = serialdev.RTTEstimator(initial=timeout)
+        self.sent = 0
+        self.sentbytes = 0
+        self.buffer = bytearray()
+        self.arrived = asyncio.Event()
+        self.error = None       # why the port failed, once it has
+        self.pump = None
+        if platform.system() != 'Windows':
+            self.fd = self.ser.fileno()
+            self.loop.add_reader(self.fd,self._readable)
+        else:
+            self.ser.timeout = 0.05
+            self.pump = self.loop.create_task(self._pumpthread())
+
+    def _readable(self):
+        """Event loop callback: the port has bytes waiting."""
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException,OSError) as e:   # OSError: EIO once the device is gone
+            self._fail(e)
+            return
+        if not data:            # readable but empty: end of file
+            self._fail(serial.SerialException('Device disconnected'))
+            return
+        self.buffer += data
+        self.arrived.set()
+
+    def _fail(self,error):
+        """The port has gone: stop watching it, and wake any waiting reads so
+        they raise instead of waiting out their timeouts."""
+        if self.error is None:
+            self.error = error
+        if self.pump is None:
+            self.loop.remove_reader(self.fd)
+        self.arrived.set()
+
+    def _check(self):
+        if self.error is not None:
+            raise serial.SerialException('Serial port failed: %s' % self.error)
+
+    async def _pumpthread(self):
+        """Read the port from a worker thread, where add_reader isn't available."""
+        while self.ser.is_open:
+            try:
+                data = await self.loop.run_in_executor(None,self.ser.read,max(self.ser.in_waiting,1))
+            except (serial.SerialException,OSError) as e:      # unplugged, or closed under the read
+                self._fail(e)
+                return
+            if data:
+                self.buffer += data
+                self.arrived.set()
+
+    def close(self):
+        if self.pump is None:
+            self.loop.remove_reader(self.fd)
+        elif not self.pump.done():
+            self.pump.cancel()
+        self.ser.close()
+
+    def flushInput(self):
+        """Throw away anything the scope sent that nobody asked for."""
+        self._check()
+        self.ser.reset_input_buffer()
+        self.buffer.clear()
+
+    async def write(self,data):
+        """Send data from a worker thread: a write blocks until the port's output
+        buffer has room."""
+        self._check()
+        self.sent = self.loop.time()
+        self.sentbytes = len(data)
+        await self.loop.run_in_executor(None,self.ser.write,data)
+
+    async def _wait(self,done,size,timeout):
+        """Wait until done() is true or timeout seconds pass.  timeout None means
+        the port's adaptive timeout for a size-byte reply."""
+        adaptive = timeout is None
+        if adaptive:
+            timeout = self.rtt.timeout() + (self.sentbytes+size)*self.bytetime
+        deadline = self.loop.time()+timeout
+        while not done():
+            self._check()
+            remaining = deadline-self.loop.time()
+            if remaining <= 0:
+                break
+            self.arrived.clear()
+            try:
+                await asyncio.wait_for(self.arrived.wait(),remaining)
+            except asyncio.TimeoutError:
+                break
+        if adaptive:
+            if not done():
+                self.rtt.backoff()
+            elif self.sentbytes:       # first reply since the last write: time it
+                elapsed = self.loop.time()-self.sent
+                self.rtt.update(max(elapsed - (self.sentbytes+size)*self.bytetime,0))
+            self.sentbytes = 0
+
+    async def read(self,size,timeout=None):
+        """Read size bytes.  Returns fewer if they don't arrive within timeout
+        seconds."""
+        await self._wait(lambda: len(self.buffer) >= size,size,timeout)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def readuntil(self,terminator=b'#',size=64,timeout=None):
+        """Read up to and including terminator, or size bytes, whichever comes
+        first.  Returns what has arrived if neither happens within timeout seconds."""
+        await self._wait(lambda: terminator in self.buffer or len(self.buffer) >= size,size,timeout)
+        end = self.buffer.find(terminator)
+        end = size if end < 0 else min(end+len(terminator),size)
+        data = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return data
+
+class AsyncNexStar:
+    """Communicates with a NexStar-compatible telescope from asyncio.  See
+    nexstar.NexStar for what each method does."""
+
+    CANSYNC = nexstar.NexStar.CANSYNC
+
+    def __init__(self):
+        self.ready = False
+        self.lock = None
+        self.rates = rateestimator.RateEstimator()         # fed by getposition()
+
+    async def open(self,comport):
+        """Open a serial connection on port comport, and check for a
+        NexStar-compatible scope."""
+        self.ready = False
+        self.lock = asyncio.Lock()
+        try:
+            self.ser = AsyncSerial(comport)
+        except serial.SerialException:
+            print('Failed to open serial port ',comport)
+            return
+        await self.command(b'V')       # Scope version
+        await self.command(b'V')
+        resp, = await self.command(b'Kq')
+        if not(resp == b'q#'):
+            print('NexStar telescope is not responding.')
+            return
+        self.ready = True
+
+    def close(self):
+        try:
+            self.ser.close()
+        except:
+            pass
+        self.ready = False
+
+    async def command(self,*cmds,timeout=None):
+        """Send commands cmds back to back, and return their replies in order.
+        See nexstar.CommandQueue."""
+        lengths = [nexstar.CommandQueue.replylength(cmd) for cmd in cmds]
+        async with self.lock:
+            self.ser.flushInput()
+            await self.ser.write(b''.join(cmds))
+            replies = []
+            for length in lengths:
+                replies.append(await self.ser.read(length,timeout))
+        for cmd,reply,length in zip(cmds,replies,lengths):
+            if len(reply) < length:
+                print('Unexpected response from telescope:',cmd,reply)
+        return replies
+
+    async def is_safe(self):
+        response, = await self.command(b't')
+        if (len(response) < 2):
+            print('No response from telescope.  Check communications.')
+            return None
+        return response[0] == 0
+
+    async def set_safe(self,safe):
+        await self.command(b'T\x00' if safe else b'T\x02')
+
+    async def getposition(self,dump=False):
+        response, = await self.command(b'e')
+        if dump:
+            print(response)
+        if (len(response)<18):
+            return None
+        pos = radec.RADec.fromNexstar(response)
+        self.rates.add(pos)
+        return pos
+
+    async def getaltaz(self,dump=False):
+        response, = await self.command(b'z')
+        if dump:
+            print(response)
+        if (len(response)<18):
+            return None
+        return radec.RADec.fromNexstar(response)
+
+    async def stop(self):
+        await self.command(nexstar.NexStar.slewcmd(16,37,0),nexstar.NexStar.slewcmd(17,36,0))
+
+    async def sleweast(self,speed):
+        await self.command(nexstar.NexStar.slewcmd(16,37,speed))
+
+    async def slewwest(self,speed):
+        await self.command(nexstar.NexStar.slewcmd(16,36,speed))
+
+    async def slewnorth(self,speed):
+        await self.command(nexstar.NexStar.slewcmd(17,36,speed))
+
+    async def slewsouth(self,speed):
+        await self.command(nexstar.NexStar.slewcmd(17,37,speed))
+
+    async def move(self,eastrate,northrate):
+        await self.command(nexstar.NexStar.ratecmd(16,-eastrate),nexstar.NexStar.ratecmd(17,northrate))
+
+    async def goto(self,pos):
+        print('Moving scope to ',pos.ra(),pos.dec())
+        await self.command(b'r'+pos.toNexstar())
+
+    async def sync(self,pos):
+        print('Syncing scope to ',pos.ra(),pos.dec())
+        await self.command(b's'+pos.toNexstar())
+
+    async def undosync(self):
+        print('Clearing SYNC')
+        await self.command(b'u')
+
+    async def write(self,data):
+        await self.ser.write(data)
+
+    async def read(self,bytecount):
+        return await self.ser.read(bytecount)
+
+    def getrate(self):
+        rate = self.rates.rate()
+        return None if rate is None else rate[0:2]
+
+class AsyncMeade:
+    """Communicates with a Meade-compatible telescope from asyncio.  See
+    meade.Meade for what each method does.  Replies are read up to their '#',
+    so short (low precision) replies don't wait out the timeout."""
+
+    CANSYNC = meade.Meade.CANSYNC
+
+    def __init__(self):
+        self.ready = False
+        self.lock = None
+        self.rates = rateestimator.RateEstimator()         # fed by getposition()
+        self.altazrates = rateestimator.RateEstimator()    # fed by getaltaz()
+
+    async def open(self,comport):
+        """Open a serial connection on port comport, wake the scope and put it in
+        high precision mode."""
+        self.ready = False
+        self.lock = asyncio.Lock()
+        try:
+            self.ser = AsyncSerial(comport,timeout=2.0)
+        except serial.SerialException:
+            print('Failed to open serial port ',comport)
+            return
+        await self.ser.write(b':hW#')  # Wake up!
+        resp = await self.query(b':GW#')
+        if len(resp) < 3:
+            print('Meade telescope is not responding.')
+            return
+        self.ready = True
+        resp = await self.query(b':GD#')
+        if len(resp) < 10:             # short declination returned
+            await self.send(b':U#')    # toggle precision
+
+    def close(self):
+        try:
+            self.ser.close()
+        except:
+            pass
+        self.ready = False
+
+    async def query(self,cmd,size=64,terminator=b'#',timeout=None):
+        """Send command cmd and return its reply, read up to terminator (or
+        size bytes, if terminator is None)."""
+        async with self.lock:
+            self.ser.flushInput()
+            await self.ser.write(cmd)
+            if terminator is None:
+                return await self.ser.read(size,timeout)
+            return await self.ser.readuntil(terminator,size,timeout)
+
+    async def send(self,cmd):
+        """Send command cmd, which has no reply."""
+        async with self.lock:
+            await self.ser.write(cmd)
+
+    async def is_safe(self):
+        response = await self.query(b':GW#')
+        if (len(response) < 4):
+            print('No response from telescope.  Check communications.')
+            return None
+        return response[1:2] == b'N'
+
+    async def set_safe(self,safe):
+        if not safe:
+            await self.send(b':hW#')   # Wake scope
+            print('Waking scope')
+            await asyncio.sleep(1)
+            if await self.is_safe():   # scope is not tracking
+                pos = await self.getposition()
+                await self.goto(pos)
+                print('GOTO to enable tracking.')
+        else:
+            await self.send(b':hN#')
+            print('Putting scope to sleep.')
+
+    async def setstarlock(self,dostarlock):
+        await self.send(b':MgS1#' if dostarlock else b':MgS0#')
+
+    async def sethighprecision(self,dohighprecision):
+        resp = await self.query(b':P#',size=14,terminator=None,timeout=0.5)
+        if (len(resp)> 1):
+            if (dohighprecision and resp[0:1] == b'L') or (not dohighprecision and resp[0:1] == b'H'):
+                await self.query(b':P#',size=14,terminator=None,timeout=0.5)   # Retoggle.
+        else:
+            print('No response from scope')
+
+    async def getposition(self,dump=False):
+        decresp = await self.query(b':GD#')
+        raresp = await self.query(b':GR#')
+        if dump:
+            print('RA: ',raresp,' Dec: ',decresp)
+        try:
+            pos = radec.RADec.fromMeade(raresp,decresp)
+        except ValueError:
+            return None
+        self.rates.add(pos)
+        return pos
+
+    async def getaltaz(self,dump=False):
+        async with self.lock:           # both in one burst, as meade.Meade.getaltaz()
+            self.ser.flushInput()
+            await self.ser.write(b':GZ#:GA#')
+            azmresp = await self.ser.readuntil(b'#',10)
+            altresp = await self.ser.readuntil(b'#',10)
+        if dump:
+            print('Az: ',azmresp,' Alt: ',altresp)
+        try:
+            pos = radec.RADec((radec.decode_meade_azimuth(azmresp)/15,radec.decode_meade_dec(altresp)))
+        except ValueError:
+            return None
+        self.altazrates.add(pos)
+        return pos
+
+    async def stop(self):
+        await self.send(b':Q#')
+
+    async def setrate(self,speed):
+        await self.send(meade.Meade.ratecmd(speed))
+
+    async def sleweast(self,speed):
+        await self.send(meade.Meade.ratecmd(speed)+b':Me#')
+
+    async def slewwest(self,speed):
+        await self.send(meade.Meade.ratecmd(speed)+b':Mw#')
+
+    async def slewnorth(self,speed):
+        await self.send(meade.Meade.ratecmd(speed)+b':Mn#')
+
+    async def slewsouth(self,speed):
+        await self.send(meade.Meade.ratecmd(speed)+b':Ms#')
+
+    async def settarget(self,pos):
+        print('Setting target position to',pos.ra(),pos.dec())
+        (meadera,meadedec) = pos.toMeade()
+        resp = await self.query(b':Sr'+meadera,size=1,terminator=None)
+        if resp != b'1':
+            raise ValueError('Right ascension not accepted by telescope.')
+        resp = await self.query(b':Sd'+meadedec,size=1,terminator=None)
+        if resp != b'1':
+            raise ValueError('Declination not accepted by telescope.')
+
+    async def goto(self,pos):
+        await self.settarget(pos)
+        print('Moving scope to ',pos.ra(),pos.dec())
+        resp = await self.query(b':MS#',size=1,terminator=None)
+        if len(resp) > 0:
+            if resp != b'0':
+                print('Object below horizon limits.')
+        else:
+            print('No response from scope.')
+
+    async def sync(self,pos):
+        print("Can't sync Meade.")
+
+    async def undosync(self):
+        print("Can't sync Meade.")
+
+    async def write(self,data):
+        await self.ser.write(data)
+
+    async def read(self,bytecount):
+        return await self.ser.read(bytecount)
+
+    def getrate(self):
+        rate = self.rates.rate()
+        return None if rate is None else rate[0:2]
+
+    def getaltazrate(self):
+        rate = self.altazrates.rate()
+        return None if rate is None else rate[0:2]
+
+    async def focus(self,time):
+        """Move the focuser for time milliseconds: inward if time is positive,
+        outward if negative.  Limited to 65 seconds.  Returns once the focuser
+        has been halted."""
+        time = min(max(time,-65000),65000)  # Limit 65000 ms focus
+        await self.timedfocus(time > 0,abs(time)/1000.)
+
+    async def timedfocus(self,inward,seconds):
+        await self.send(b':F+#' if inward else b':F-#')
+        try:
+            await asyncio.sleep(seconds)
+        finally:                # halt even if cancelled
+            await self.send(b':FQ#')
+
+    async def focusin(self):
+        await self.send(b':F+#')
+
+    async def focusout(self):
+        await self.send(b':F-#')
+
+    async def focushalt(self):
+        await self.send(b':FQ#')
+
+    async def focusspeed(self,speed):
+        speed = min(max(speed,1),4)
+        await self.send((':F%1d#'%speed).encode())
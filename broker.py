@@ -0,0 +1,235 @@
+""" Broker: lets several programs share one telescope.
+
+Only one process can have the scope's serial port open, so the broker opens it
+and everyone else talks to the broker over a Unix socket.  BrokerClient has the
+same methods as the nexstar.NexStar or meade.Meade object behind the broker, so
+a script can use either:
+
+    scope = broker.BrokerClient()
+    pos = scope.getposition()
+
+Commands from all the clients are run one at a time.  Reads that are already in
+progress when an identical read arrives (several clients polling getposition()
+at once, say) are answered with the result of the one serial transaction.
+
+The protocol is one JSON object per line.  Requests are
+{"method": name, "args": [...], "kwargs": {...}}; replies are {"result": value}
+or {"error": message}.  RADec positions, in arguments and results, travel as
+{"radec": [ra, dec]}.
+
+Run the broker with:  python broker.py nexstar|meade COMPORT [SOCKETPATH]"""
+
+import concurrent.futures
+import errno
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+
+import radec
+
+SOCKETPATH = os.path.join(tempfile.gettempdir(),'scope-broker.sock')
+
+# Methods that only read from the scope, so identical calls can share a result
+READS = ('getposition','getaltaz','is_safe','getrate','getaltazrate','status','getversion')
+
+# Methods clients may not call: the broker owns the port
+PRIVATE = ('open','close','read','write')
+
+# Attributes clients may read, by "calling" them
+ATTRIBUTES = ('ready',)
+
+def encode(value):
+    """A driver's argument or return value, made fit for JSON."""
+    if isinstance(value,radec.RADec):
+        return {'radec':[value[0],value[1]]}
+    if isinstance(value,(list,tuple)):
+        return [encode(v) for v in value]
+    if isinstance(value,dict):
+        return dict((k,encode(v)) for k,v in value.items())
+    if isinstance(value,bytes):
+        return value.decode('latin-1')
+    if value is None or isinstance(value,(bool,int,float,str)):
+        return value
+    return None     # e.g. a scheduler.Job; it means nothing outside the broker
+
+def decode(value):
+    """Undo encode(), as far as the drivers and clients need."""
+    if isinstance(value,dict):
+        if list(value) == ['radec']:
+            return radec.RADec(value['radec'])
+        return dict((k,decode(v)) for k,v in value.items())
+    if isinstance(value,list):
+        return [decode(v) for v in value]
+    return value
+
+class Broker:
+    """Runs commands from many clients on scope, a nexstar.NexStar or
+    meade.Meade object, one at a time."""
+
+    def __init__(self,scope):
+        self.scope = scope
+        self.lock = threading.Lock()            # one command on the scope at a time
+        self.pendinglock = threading.Lock()
+        self.pending = {}                       # (method, args) -> Future, for reads in progress
+        self.calls = 0
+        self.shared = 0                         # reads answered by another client's transaction
+
+    def allowed(self,method):
+        return (not method.startswith('_') and method not in PRIVATE
+                and callable(getattr(self.scope,method,None)))
+
+    def run(self,method,args,kwargs):
+        with self.lock:
+            return getattr(self.scope,method)(*args,**kwargs)
+
+    def call(self,method,args=(),kwargs={}):
+        """Call scope.method(*args,**kwargs), or read scope.method if it is one of
+        ATTRIBUTES.  Raises ValueError if method isn't one clients may call."""
+        if method in ATTRIBUTES:
+            return getattr(self.scope,method)
+        if not self.allowed(method):
+            raise ValueError('No such telescope command: %s' % method)
+        self.calls += 1
+        if method not in READS:
+            return self.run(method,args,kwargs)
+        key = (method,json.dumps([args,kwargs],sort_keys=True))
+        with self.pendinglock:
+            future = self.pending.get(key)
+            if future is not None:
+                self.shared += 1
+                owner = False
+            else:
+                future = self.pending[key] = concurrent.futures.Future()
+                owner = True
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(self.run(method,args,kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.pendinglock:
+                del self.pending[key]
+        return future.result()
+
+    def report(self):
+        """A one-line summary of the calls shared."""
+        return 'Broker: %d calls, %d reads shared.' % (self.calls,self.shared)
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                result = broker.call(request['method'],decode(request.get('args',[])),
+                                     decode(request.get('kwargs',{})))
+                reply = {'result':encode(result)}
+            except Exception as e:
+                reply = {'error':'%s: %s' % (type(e).__name__,e)}
+            self.wfile.write(json.dumps(reply).encode()+b'\n')
+
+class BrokerServer(socketserver.ThreadingMixIn,socketserver.UnixStreamServer):
+    """Serves broker, a Broker, on the Unix socket at path, which only this
+    user can connect to.  Raises OSError (EADDRINUSE) if another broker is
+    already serving there."""
+
+    daemon_threads = True
+
+    def __init__(self,broker,path=SOCKETPATH):
+        self.broker = broker
+        if os.path.exists(path):
+            other = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+            try:
+                other.connect(path)
+            except OSError:
+                os.unlink(path)     # left over from a broker that didn't shut down
+            else:
+                raise OSError(errno.EADDRINUSE,'A broker is already serving on',path)
+            finally:
+                other.close()
+        socketserver.UnixStreamServer.__init__(self,path,BrokerHandler)
+        os.chmod(path,0o600)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+class BrokerClient:
+    """Stands in for the driver object in the broker at path.  Any driver method
+    can be called on it; errors in the broker are raised as RuntimeError."""
+
+    def __init__(self,path=SOCKETPATH):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    @property
+    def ready(self):
+        """True if the broker is reachable and its scope is ready."""
+        try:
+            return bool(self.call('ready'))
+        except (OSError,RuntimeError):
+            return False
+
+    def call(self,method,*args,**kwargs):
+        request = json.dumps({'method':method,'args':encode(args),'kwargs':encode(kwargs)}).encode()+b'\n'
+        with self.lock:
+            self.file.write(request)
+            self.file.flush()
+            line = self.file.readline()
+        if not line:
+            raise RuntimeError('Broker closed the connection')
+        reply = json.loads(line)
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return decode(reply['result'])
+
+    def __getattr__(self,method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *args,**kwargs: self.call(method,*args,**kwargs)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1].lower() not in ('nexstar','meade'):
+        print('Usage: python broker.py nexstar|meade COMPORT [SOCKETPATH]')
+        sys.exit(1)
+    if sys.argv[1].lower() == 'nexstar':
+        import nexstar
+        scope = nexstar.NexStar(sys.argv[2])
+    else:
+        import meade
+        scope = meade.Meade(sys.argv[2])
+    if not scope.ready:
+        print('No telescope on',sys.argv[2])
+        sys.exit(1)
+    path = sys.argv[3] if len(sys.argv) > 3 else SOCKETPATH
+    try:
+        server = BrokerServer(Broker(scope),path)
+    except OSError as e:
+        print("Can't serve on",path,':',e)
+        scope.close()
+        sys.exit(1)
+    print('Serving telescope on',path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.broker.report())
+        server.server_close()
+        scope.close()
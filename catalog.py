@@ -0,0 +1,221 @@
+""" Catalog: a local star and deep-sky object catalog for GOTO without a
+planetarium program.
+
+Catalogs are built once from CSV into a binary file, which is then memory-mapped:
+opening even a very large catalog reads almost nothing.  The binary file holds
+the objects sorted into one-degree declination zones, each sorted by right
+ascension, so cone and nearest-neighbour searches only touch a few zones; and a
+hash table on object names, so name lookup takes constant time.
+
+CSV files need a header row with columns "name", "ra" and "dec", and may have
+a "mag" column.  RA is decimal hours or "##h##m##s"; dec is decimal degrees or
+"+##d##m##s".  An object with several names lists them separated by
+semicolons, e.g. "M31;NGC 224;Andromeda Galaxy".
+
+    cat = catalog.Catalog.fromCSV('messier.csv','messier.cat')
+    scope.goto(cat.lookup('M 31'))
+    for match in cat.cone(scope.getposition(),2.0):
+        print(match.name,match.mag,match.separation)
+"""
+
+import collections
+import csv
+import math
+import mmap
+import struct
+import zlib
+
+import radec
+
+_HEADER = struct.Struct('<8sIIII')     # magic, objects, zones, hash slots, name bytes
+_RECORD = struct.Struct('<ddfII')      # ra hours, dec degrees, magnitude, name offset, name length
+_RA = struct.Struct('<d')
+_INDEX = struct.Struct('<I')
+MAGIC = b'SMCAT\x00\x01\x00'
+ZONES = 180                            # one-degree declination zones, -90 to +90
+
+Match = collections.namedtuple('Match',['name','pos','mag','separation'])
+
+def normalize(name):
+    """Names are matched without regard to case or spaces: 'M 31' is 'm31'."""
+    return ''.join(name.split()).upper()
+
+def zone(dec):
+    """Declination zone number for dec in decimal degrees."""
+    return min(max(int(math.floor(dec+90)),0),ZONES-1)
+
+def separation(ra1,dec1,ra2,dec2):
+    """Angle in degrees between two positions (RA in hours, dec in degrees)."""
+    ra1,ra2 = math.radians(15*ra1),math.radians(15*ra2)
+    dec1,dec2 = math.radians(dec1),math.radians(dec2)
+    h = math.sin((dec2-dec1)/2)**2 + math.cos(dec1)*math.cos(dec2)*math.sin((ra2-ra1)/2)**2
+    return math.degrees(2*math.asin(min(math.sqrt(h),1.0)))
+
+def _parse(value,sexagesimal):
+    """Parse a decimal or ##h##m##s / ##d##m##s coordinate."""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    sign = -1 if value.strip().startswith('-') else 1
+    parts = value.strip().lstrip('+-')
+    for unit in sexagesimal:
+        parts = parts.replace(unit,' ')
+    fields = [float(part) for part in parts.split()]
+    if not fields or len(fields) > 3:
+        raise ValueError('Bad coordinate '+repr(value))
+    fields += [0]*(3-len(fields))
+    return sign*(fields[0] + fields[1]/60 + fields[2]/3600)
+
+class Catalog:
+    """A memory-mapped, indexed catalog file.  See the module docstring."""
+
+    def __init__(self,path):
+        self.file = open(path,'rb')
+        self.map = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        magic,self.count,zones,self.slots,namebytes = _HEADER.unpack_from(self.map,0)
+        if magic != MAGIC or zones != ZONES:
+            self.close()
+            raise ValueError(path+' is not a Scope Manager catalog.')
+        self.zonebase = _HEADER.size
+        self.recordbase = self.zonebase + (ZONES+1)*_INDEX.size
+        self.hashbase = self.recordbase + self.count*_RECORD.size
+        self.namebase = self.hashbase + self.slots*_INDEX.size
+        self.zonestart = struct.unpack_from('<%dI' % (ZONES+1),self.map,self.zonebase)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def build(objects,path):
+        """Write a catalog file from an iterable of (name, ra, dec, mag) tuples."""
+        objects = sorted(objects,key=lambda obj: (zone(obj[2]),obj[1]))
+        names = bytearray()
+        records = bytearray()
+        zonestart = [0]*(ZONES+1)
+        slots = 16
+        aliases = sum(len(obj[0].split(';')) for obj in objects)
+        while slots < 2*aliases:
+            slots *= 2
+        table = [0]*slots
+        for index,(name,ra,dec,mag) in enumerate(objects):
+            zonestart[zone(dec)+1] = index+1
+            encoded = name.encode('utf-8')
+            records += _RECORD.pack(ra,dec,mag,len(names),len(encoded))
+            names += encoded
+            for alias in name.split(';'):
+                slot = zlib.crc32(normalize(alias).encode('utf-8')) & (slots-1)
+                while table[slot]:              # linear probing
+                    slot = (slot+1) & (slots-1)
+                table[slot] = index+1
+        for z in range(1,ZONES+1):              # empty zones start where the last one ended
+            zonestart[z] = max(zonestart[z],zonestart[z-1])
+        with open(path,'wb') as f:
+            f.write(_HEADER.pack(MAGIC,len(objects),ZONES,slots,len(names)))
+            f.write(struct.pack('<%dI' % (ZONES+1),*zonestart))
+            f.write(records)
+            f.write(struct.pack('<%dI' % slots,*table))
+            f.write(names)
+
+    @classmethod
+    def fromCSV(cls,csvpath,path):
+        """Build catalog file path from CSV file csvpath, and open it."""
+        objects = []
+        with open(csvpath,newline='',encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                row = {key.strip().lower(): value for key,value in row.items() if key}
+                mag = row.get('mag') or 'nan'
+                objects.append((row['name'].strip(), _parse(row['ra'],'hms:'),
+                                _parse(row['dec'],'dms:*\'"'), float(mag)))
+        cls.build(objects,path)
+        return cls(path)
+
+    def record(self,index):
+        """(name, RADec, magnitude) for the object at record index."""
+        ra,dec,mag,nameoffset,namelength = _RECORD.unpack_from(self.map,self.recordbase+index*_RECORD.size)
+        start = self.namebase+nameoffset
+        return (self.map[start:start+namelength].decode('utf-8'), radec.RADec((ra,dec)), mag)
+
+    def find(self,name):
+        """Record index of the object called name, or None."""
+        key = normalize(name)
+        slot = zlib.crc32(key.encode('utf-8')) & (self.slots-1)
+        while True:
+            index = _INDEX.unpack_from(self.map,self.hashbase+slot*_INDEX.size)[0]
+            if not index:
+                return None
+            ra,dec,mag,nameoffset,namelength = _RECORD.unpack_from(self.map,self.recordbase+(index-1)*_RECORD.size)
+            start = self.namebase+nameoffset
+            aliases = self.map[start:start+namelength].decode('utf-8').split(';')
+            if any(normalize(alias) == key for alias in aliases):
+                return index-1
+            slot = (slot+1) & (self.slots-1)
+
+    def lookup(self,name):
+        """Position of the object called name as a RADec object, or None if
+        it isn't in the catalog."""
+        index = self.find(name)
+        if index is None:
+            return None
+        return self.record(index)[1]
+
+    def _bisect(self,ra,lo,hi):
+        """First record index in lo..hi with right ascension >= ra."""
+        base = self.recordbase
+        size = _RECORD.size
+        while lo < hi:
+            mid = (lo+hi)//2
+            if _RA.unpack_from(self.map,base+mid*size)[0] < ra:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo
+
+    def cone(self,pos,radius,limit=None):
+        """Objects within radius degrees of RADec object pos, nearest first, as a
+        list of Match(name, pos, mag, separation) tuples.  limit, if given, is the
+        faintest magnitude to include."""
+        ra,dec = pos[0],pos[1]
+        matches = []
+        for z in range(zone(dec-radius),zone(dec+radius)+1):
+            lo,hi = self.zonestart[z],self.zonestart[z+1]
+            if lo == hi:
+                continue
+            edge = max(abs(z-90),abs(z-89))            # zone's declination nearest a pole
+            if edge + radius >= 90:
+                spans = [(lo,hi)]
+            else:
+                width = math.degrees(math.asin(min(math.sin(math.radians(radius))/math.cos(math.radians(edge)),1.0)))/15
+                if width >= 12:
+                    spans = [(lo,hi)]
+                else:
+                    start,stop = (ra-width) % 24,(ra+width) % 24
+                    if start <= stop:
+                        spans = [(self._bisect(start,lo,hi),self._bisect(stop,lo,hi))]
+                    else:                               # window wraps through 0h
+                        spans = [(lo,self._bisect(stop,lo,hi)),(self._bisect(start,lo,hi),hi)]
+            for first,last in spans:
+                for index in range(first,last):
+                    objra,objdec,mag,nameoffset,namelength = \
+                        _RECORD.unpack_from(self.map,self.recordbase+index*_RECORD.size)
+                    sep = separation(ra,dec,objra,objdec)
+                    if sep <= radius and (limit is None or not mag > limit):
+                        start = self.namebase+nameoffset
+                        matches.append(Match(self.map[start:start+namelength].decode('utf-8'),
+                                             radec.RADec((objra,objdec)),mag,sep))
+        matches.sort(key=lambda match: match.separation)
+        return matches
+
+    def nearest(self,pos,count=1,limit=None):
+        """The count objects nearest RADec object pos, as a list of Match tuples
+        (see cone()).  limit, if given, is the faintest magnitude to include."""
+        radius = 0.5
+        while True:
+            matches = self.cone(pos,radius,limit)
+            if len(matches) >= count or radius >= 180:
+                return matches[:count]
+            radius *= 2
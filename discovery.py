@@ -0,0 +1,125 @@
+""" Finds telescopes on serial ports, probing every port at once.
+
+Probing a port means trying to open it as a NexStar, then as a Meade, which can
+take seconds per port; doing all the ports in parallel means startup takes as
+long as the slowest port, not the sum of them all.
+
+A ProbeCache remembers what was found on each device, by its stable identity
+(see serialist.identity()), so the next time that device is plugged in only
+the right driver is tried."""
+
+import concurrent.futures
+import json
+import os
+import threading
+
+import meade
+import nexstar
+import serialist
+
+CACHEPATH = os.path.join(os.path.expanduser('~'),'.scopemanager-probes.json')
+
+def probe_nexstar(port):
+    scope = nexstar.NexStar(port)
+    try:
+        if scope.ready:
+            return ('NexStar',scope.version)
+    finally:
+        scope.close()
+    return None
+
+def probe_meade(port):
+    scope = meade.Meade(port)
+    try:
+        if scope.ready:
+            return ('Meade',scope.getversion())
+    finally:
+        scope.close()
+    return None
+
+def probe(port,expect=None,cancel=None):
+    """Look for a telescope on serial port port.  Returns a (scope type, firmware
+    version) pair, e.g. ('NexStar', '4.21'), or None if nothing answers.  The
+    scope type expect, if given, is tried first.  If cancel (a threading.Event)
+    is set, no further scope types are tried."""
+    probes = [probe_nexstar,probe_meade]
+    if expect == 'Meade':
+        probes.reverse()
+    for scopeprobe in probes:
+        if cancel is not None and cancel.is_set():
+            return None
+        result = scopeprobe(port)
+        if result is not None:
+            return result
+    return None
+
+class ProbeCache:
+    """Probe results saved in the JSON file at path, keyed by device identity."""
+
+    def __init__(self,path=CACHEPATH):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.results = json.load(f)
+        except (OSError,ValueError):
+            self.results = {}
+
+    def get(self,port):
+        """The (scope type, version) last found on the device at port, or None."""
+        result = self.results.get(serialist.identity(port))
+        return None if result is None else tuple(result)
+
+    def put(self,port,result):
+        """Remember result (None: nothing) for the device at port, and save."""
+        key = serialist.identity(port)
+        with self.lock:
+            if result is None:
+                if self.results.pop(key,None) is None:
+                    return
+            else:
+                self.results[key] = list(result)
+            try:
+                with open(self.path,'w') as f:
+                    json.dump(self.results,f,indent=1)
+            except OSError as e:
+                print("Can't save probe results:",e)
+
+def cachedprobe(port,cache,cancel=None):
+    known = cache.get(port)
+    result = probe(port,known[0] if known else None,cancel)
+    if cancel is not None and cancel.is_set():
+        return result           # a cut-short probe proves nothing
+    if result != known:
+        cache.put(port,result)
+    return result
+
+def discover(ports,deadline=10.0,workers=None,cache=None):
+    """Probe every port in ports concurrently.  Returns a dict mapping each port
+    where a telescope was found to its (scope type, firmware version) pair, in
+    the order of ports.  Ports still being probed after deadline seconds are
+    left out.  With a ProbeCache, each port is probed for the scope last found
+    on its device first, and the cache is updated.
+
+    Probes still running at the deadline stop before trying another scope type,
+    and are waited for, so that no port is still held open when this returns
+    and the caller opens it: that can take one driver's open() past the
+    deadline."""
+    if not ports:
+        return {}
+    cancel = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(ports))
+    if cache is None:
+        futures = {port: executor.submit(probe,port,None,cancel) for port in ports}
+    else:
+        futures = {port: executor.submit(cachedprobe,port,cache,cancel) for port in ports}
+    intime,_ = concurrent.futures.wait(futures.values(),timeout=deadline)
+    cancel.set()
+    executor.shutdown(wait=True,cancel_futures=True)
+    found = {}
+    for port,future in futures.items():
+        if future in intime and future.exception() is None:
+            result = future.result()
+            if result is not None:
+                found[port] = result
+    return found
@@ -0,0 +1,433 @@
+""" Telescope emulators: a simulated NexStar or Meade scope on a pseudo-terminal,
+for trying out the drivers, the UI and the Stellarium link without hardware.
+
+Each emulator opens a Linux pty and answers the command set the drivers use
+on it, just as a scope on a serial port would; point a driver at its port:
+
+    scope = emulator.NexStarEmulator()
+    telescope = nexstar.NexStar(scope.port)
+
+Behind both emulators is a Mount, which slews, tracks, moves at the commanded
+rates and does GOTOs at a finite speed, so positions change the way a real
+scope's do.  For a reproducible test bed, the serial link can be made as bad
+as a real one:
+
+    baudrate    limits throughput to baudrate/10 bytes/second each way
+                (None: as fast as the pty goes)
+    latency     seconds the scope takes to start replying
+    drop        probability of losing each byte of a reply
+    timeout     probability of not replying to a command at all
+    seed        seeds the random numbers behind drop and timeout
+
+Run one from the command line with:  python emulator.py nexstar|meade [options]"""
+
+import argparse
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+import altaz
+import radec
+
+SIDEREAL = 15.041       # Sidereal rate, arcseconds/second
+
+class Mount:
+    """A simulated equatorial mount pointing at ra (hours), dec (degrees), at a
+    site at latitude, longitude for alt/az.  Axis 0 moves east (RA increasing),
+    axis 1 north; rates are in arcseconds/second.  Not tracking, the mount
+    stays put against the ground, so its RA drifts at the sidereal rate."""
+
+    GOTORATE = 4.0      # GOTO slewing speed, degrees/second per axis
+
+    def __init__(self,ra=0.0,dec=0.0,latitude=45.0,longitude=0.0,clock=time.monotonic):
+        self.ra = ra
+        self.dec = dec
+        self.site = altaz.Site(latitude,longitude)
+        self.clock = clock
+        self.tracking = True
+        self.rates = [0.0,0.0]
+        self.until = [None,None]        # clock time each axis stops, for timed moves
+        self.target = None              # (ra, dec) of a GOTO in progress
+        self.focuser = 0.0              # focuser position, in steps
+        self.focusrate = 0.0            # steps/second
+        self.last = clock()
+        self.lock = threading.RLock()
+
+    def advance(self):
+        """Bring the simulation up to the present."""
+        with self.lock:
+            now = self.clock()
+            dt = now-self.last
+            self.last = now
+            if dt <= 0:
+                return
+            moved = [0.0,0.0]       # degrees
+            for axis in (0,1):
+                active = dt
+                if self.until[axis] is not None:
+                    active = min(max(self.until[axis]-(now-dt),0.0),dt)
+                    if now >= self.until[axis]:
+                        self.until[axis] = None
+                        self.rates[axis] = 0.0
+                moved[axis] += self.rates[axis]*active/3600
+            self.ra = (self.ra + moved[0]/15) % 24
+            self.dec = min(max(self.dec + moved[1],-90.0),90.0)
+            if not self.tracking:
+                self.ra = (self.ra + dt*1.0027379/3600) % 24
+            if self.target is not None:
+                step = self.GOTORATE*dt
+                dra = (self.target[0]-self.ra+12) % 24 - 12
+                ddec = self.target[1]-self.dec
+                self.ra = (self.ra + min(max(dra,-step/15),step/15)) % 24
+                self.dec += min(max(ddec,-step),step)
+                if abs(dra)*15 <= step and abs(ddec) <= step:
+                    self.target = None
+            self.focuser += self.focusrate*dt
+
+    def position(self):
+        """Current (ra, dec)."""
+        with self.lock:
+            self.advance()
+            return (self.ra,self.dec)
+
+    def altaz(self):
+        """Current (altitude, azimuth)."""
+        return self.site.toAltAz(self.position())
+
+    @property
+    def slewing(self):
+        with self.lock:
+            self.advance()
+            return self.target is not None
+
+    def move(self,axis,rate,duration=None):
+        """Move axis at rate, for duration seconds or until stopped."""
+        with self.lock:
+            self.advance()
+            self.rates[axis] = rate
+            self.until[axis] = None if duration is None else self.clock()+duration
+
+    def stop(self,axis=None):
+        """Stop axis (default: both axes, and any GOTO)."""
+        with self.lock:
+            self.advance()
+            for a in ((0,1) if axis is None else (axis,)):
+                self.rates[a] = 0.0
+                self.until[a] = None
+            if axis is None:
+                self.target = None
+
+    def goto(self,ra,dec):
+        with self.lock:
+            self.advance()
+            self.target = (ra % 24,min(max(dec,-90.0),90.0))
+
+    def sync(self,ra,dec):
+        with self.lock:
+            self.advance()
+            self.ra = ra % 24
+            self.dec = min(max(dec,-90.0),90.0)
+
+    def focus(self,rate):
+        with self.lock:
+            self.advance()
+            self.focusrate = rate
+
+class Emulator(threading.Thread):
+    """Serves a simulated scope on a pty; subclasses speak the protocols.  The
+    driver end of the pty is self.port."""
+
+    def __init__(self,mount=None,baudrate=None,latency=0.0,drop=0.0,timeout=0.0,seed=None):
+        threading.Thread.__init__(self,name=type(self).__name__,daemon=True)
+        self.mount = mount if mount is not None else Mount()
+        self.baudrate = baudrate
+        self.latency = latency
+        self.drop = drop
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.master,self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.commands = 0
+        self.dropped = 0            # reply bytes lost
+        self.timeouts = 0           # commands not answered
+        self.running = True
+        self.start()
+
+    def close(self):
+        self.running = False
+        self.join(1.0)
+        os.close(self.master)
+        os.close(self.slave)
+
+    def transmit(self,count):
+        """Wait as long as count bytes take to cross the link."""
+        if self.baudrate:
+            time.sleep(count*10/self.baudrate)
+
+    def respond(self,reply):
+        """Send reply to the driver, through the simulated link's faults."""
+        if self.timeout and self.random.random() < self.timeout:
+            self.timeouts += 1
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        if self.drop:
+            kept = bytes(b for b in reply if self.random.random() >= self.drop)
+            self.dropped += len(reply)-len(kept)
+            reply = kept
+        self.transmit(len(reply))
+        os.write(self.master,reply)
+
+    def run(self):
+        buf = bytearray()
+        while self.running:
+            ready,_,_ = select.select([self.master],[],[],0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master,256)
+            except OSError:
+                return
+            self.transmit(len(data))
+            buf += data
+            while buf:
+                used,reply = self.parse(buf)
+                if not used:
+                    break
+                del buf[:used]
+                if used and reply is not None:
+                    self.commands += 1
+                    self.respond(reply)
+
+    def parse(self,buf):
+        """Interpret the command at the start of buf.  Returns (bytes used, reply),
+        reply None for no reply; used is 0 if the command is incomplete."""
+        raise NotImplementedError
+
+    def report(self):
+        """A one-line summary of the emulator's traffic."""
+        return '%s: %d commands, %d reply bytes dropped, %d timeouts.' % \
+               (type(self).__name__,self.commands,self.dropped,self.timeouts)
+
+class NexStarEmulator(Emulator):
+    """A Celestron NexStar hand controller, version 4.21."""
+
+    VERSION = b'\x04\x15'
+    LENGTHS = {0x50:8, 0x72:18, 0x73:18, 0x54:2, 0x4B:2}     # P, r, s, T, K; the rest are 1 byte
+    FIXEDRATES = (0,30,60,120,240,480,1080,1800,7200,14400)  # arcseconds/second for speeds 0-9
+
+    def parse(self,buf):
+        op = buf[0]
+        size = self.LENGTHS.get(op,1)
+        if len(buf) < size:
+            return (0,None)
+        cmd = bytes(buf[:size])
+        mount = self.mount
+        if op == 0x56:                      # V: version
+            return (size,self.VERSION+b'#')
+        if op == 0x4B:                      # K: echo
+            return (size,cmd[1:2]+b'#')
+        if op == 0x65:                      # e: RA/dec
+            return (size,radec.encode_nexstar(*mount.position())+b'#')
+        if op == 0x7A:                      # z: azimuth/altitude
+            alt,az = mount.altaz()
+            return (size,radec.encode_nexstar(az/15,alt)+b'#')
+        if op == 0x74:                      # t: tracking mode
+            return (size,bytes([2 if mount.tracking else 0])+b'#')
+        if op == 0x54:                      # T: set tracking mode
+            mount.tracking = cmd[1] != 0
+            return (size,b'#')
+        if op == 0x4C:                      # L: GOTO in progress?
+            return (size,b'1#' if mount.slewing else b'0#')
+        if op == 0x4D:                      # M: cancel GOTO
+            mount.stop()
+            return (size,b'#')
+        if op in (0x72,0x73):               # r: GOTO, s: sync
+            try:
+                ra,dec = radec.decode_nexstar(cmd,1)
+            except ValueError:
+                return (size,b'#')
+            if dec > 180:
+                dec -= 360
+            if op == 0x72:
+                mount.goto(ra,dec)
+            else:
+                mount.sync(ra,dec)
+            return (size,b'#')
+        if op == 0x75:                      # u: undo sync
+            return (size,b'#')
+        if op == 0x50:                      # P: passthrough
+            return (size,self.passthrough(cmd))
+        return (1,None)                     # not a command: ignore the byte
+
+    def passthrough(self,cmd):
+        length,axis,msgid = cmd[1],cmd[2],cmd[3]
+        if axis in (16,17):
+            # Axis 16 turns west for positive rates; Mount axis 0 turns east.
+            a,sign = (0,-1) if axis == 16 else (1,1)
+            if msgid in (36,37):            # fixed-rate slew
+                rate = self.FIXEDRATES[min(cmd[4],9)]
+                self.mount.move(a,sign*(rate if msgid == 36 else -rate))
+            elif msgid in (6,7):            # variable-rate slew, in 1/4 arcsecond/second
+                rate = ((cmd[4] << 8) | cmd[5])/4
+                self.mount.move(a,sign*(rate if msgid == 6 else -rate))
+        return bytes(cmd[7])+b'#'
+
+class MeadeEmulator(Emulator):
+    """A Meade LX200-compatible (Autostar) scope."""
+
+    VERSION = b'43Eg#'
+    RATES = {b':RG#':7.5, b':RC#':240, b':RM#':1800, b':RS#':14400}    # arcseconds/second
+    MOVES = {b'e':(0,1), b'w':(0,-1), b'n':(1,1), b's':(1,-1)}         # (axis, sign)
+    FOCUSRATES = {1:10, 2:50, 3:200, 4:1000}                          # steps/second
+
+    def __init__(self,*args,**kwargs):
+        self.highprecision = True
+        self.rate = 14400
+        self.focusrate = 1000
+        self.target = (0.0,0.0)
+        self.wastracking = None         # tracking before :hN#, while asleep
+        Emulator.__init__(self,*args,**kwargs)
+
+    def ra(self,hours):
+        if self.highprecision:
+            return radec.encode_meade_ra(hours)
+        minutes = int(hours*600) % 14400
+        return b'%02d:%02d.%1d#' % (minutes//600,(minutes//10) % 60,minutes % 10)
+
+    def degrees(self,value,sign=True):
+        """value as b'sDD*MM'SS#' (b'DDD*MM'SS#' if not sign), or without seconds
+        in low precision."""
+        seconds = int(round(abs(value)*3600))
+        d,m,s = seconds//3600,(seconds//60) % 60,seconds % 60
+        text = (b'-' if value < 0 else b'+') + b'%02d' % d if sign else b'%03d' % d
+        if self.highprecision:
+            return text + b"*%02d'%02d#" % (m,s)
+        return text + b'*%02d#' % m
+
+    def parse(self,buf):
+        if buf[0] == 0x06:                  # ACK: alignment mode
+            return (1,b'P')
+        if buf[0] != 0x3A:                  # not ':' - noise between commands
+            return (1,None)
+        end = buf.find(b'#')
+        if end < 0:
+            return (0,None)
+        return (end+1,self.command(bytes(buf[:end+1])))
+
+    def command(self,cmd):
+        mount = self.mount
+        if cmd == b':GR#':
+            return self.ra(mount.position()[0])
+        if cmd == b':GD#':
+            return self.degrees(mount.position()[1])
+        if cmd == b':GA#':
+            return self.degrees(mount.altaz()[0])
+        if cmd == b':GZ#':
+            return self.degrees(mount.altaz()[1] % 360,sign=False)
+        if cmd == b':GW#':
+            return b'P' + (b'T' if mount.tracking else b'N') + b'1#'
+        if cmd == b':GVN#':
+            return self.VERSION
+        if cmd == b':GVP#':
+            return b'Autostar#'
+        if cmd == b':U#':
+            self.highprecision = not self.highprecision
+            return None
+        if cmd == b':P#':
+            self.highprecision = not self.highprecision
+            return b'HIGH PRECISION' if self.highprecision else b'LOW  PRECISION'
+        if cmd.startswith(b':Sr'):
+            try:
+                self.target = (radec.decode_meade_ra(cmd,3),self.target[1])
+            except ValueError:
+                return b'0'
+            return b'1'
+        if cmd.startswith(b':Sd'):
+            try:
+                self.target = (self.target[0],radec.decode_meade_dec(cmd,3))
+            except ValueError:
+                return b'0'
+            return b'1'
+        if cmd == b':MS#':
+            alt,az = mount.site.toAltAz(self.target)
+            if alt < 0:
+                return b'1Object Below Horizon#'
+            mount.goto(*self.target)
+            return b'0'
+        if cmd == b':CM#':
+            mount.sync(*self.target)
+            return b' Coordinates     matched.        #'
+        if cmd == b':D#':
+            return b'\x7f#' if mount.slewing else b'#'
+        if cmd in self.RATES:
+            self.rate = self.RATES[cmd]
+            return None
+        if cmd.startswith(b':Mg') and len(cmd) == 9 and cmd[3:4] in self.MOVES:
+            axis,sign = self.MOVES[cmd[3:4]]     # pulse guide: :MgnDDDD#
+            try:
+                ms = int(cmd[4:8])
+            except ValueError:
+                return None
+            mount.move(axis,sign*self.RATES[b':RG#'],ms/1000.)
+            return None
+        if len(cmd) == 4 and cmd[1:2] == b'M' and cmd[2:3] in self.MOVES:
+            axis,sign = self.MOVES[cmd[2:3]]
+            mount.move(axis,sign*self.rate)
+            return None
+        if cmd == b':Q#':
+            mount.stop()
+            return None
+        if len(cmd) == 4 and cmd[1:2] == b'Q' and cmd[2:3] in self.MOVES:
+            mount.stop(self.MOVES[cmd[2:3]][0])
+            return None
+        if cmd == b':hN#':
+            if self.wastracking is None:
+                self.wastracking = mount.tracking
+            mount.tracking = False
+            return None
+        if cmd == b':hW#':
+            if self.wastracking is not None:
+                mount.tracking = self.wastracking
+                self.wastracking = None
+            return None
+        if cmd == b':F+#':
+            mount.focus(self.focusrate)
+        elif cmd == b':F-#':
+            mount.focus(-self.focusrate)
+        elif cmd == b':FQ#':
+            mount.focus(0)
+        elif cmd in (b':F1#',b':F2#',b':F3#',b':F4#'):
+            self.focusrate = self.FOCUSRATES[cmd[2]-0x30]
+        elif cmd == b':FF#':
+            self.focusrate = self.FOCUSRATES[4]
+        elif cmd == b':FS#':
+            self.focusrate = self.FOCUSRATES[1]
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Emulate a telescope on a pseudo-terminal.')
+    parser.add_argument('protocol',choices=('nexstar','meade'))
+    parser.add_argument('--baudrate',type=int,default=None,help='limit throughput to this baud rate')
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds before each reply')
+    parser.add_argument('--drop',type=float,default=0.0,help='probability of losing each reply byte')
+    parser.add_argument('--timeout',type=float,default=0.0,help='probability of ignoring a command')
+    parser.add_argument('--seed',type=int,default=None)
+    parser.add_argument('--ra',type=float,default=0.0,help='starting RA, hours')
+    parser.add_argument('--dec',type=float,default=0.0,help='starting dec, degrees')
+    args = parser.parse_args()
+    cls = NexStarEmulator if args.protocol == 'nexstar' else MeadeEmulator
+    scope = cls(Mount(args.ra,args.dec),baudrate=args.baudrate,latency=args.latency,
+                drop=args.drop,timeout=args.timeout,seed=args.seed)
+    print('Emulating a',args.protocol,'telescope on',scope.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(scope.report())
+        scope.close()
@@ -2,13 +2,28 @@
 Serial port must be passed in at instance creation."""
 
 import serial
+import serialdev
 import radec
+import rateestimator
+import stateshadow
+import stats
+import scheduler
 import time
 
 class Meade:
 
+    # Longest reply to each query, in bytes, including the trailing '#'.  Replies
+    # are read up to their '#', so shorter ones (low precision) don't wait.
+    REPLYLENGTHS = {b':GR#':9, b':GD#':10, b':GW#':4, b':GZ#':10, b':GA#':10, b':GVN#':16}
+    CANSYNC = False     # sync() is disabled: there's no way to clear a Meade sync
+
     def __init__(self,comport=None):
         self.ready = False
+        self.rates = rateestimator.RateEstimator()         # fed by getposition()
+        self.altazrates = rateestimator.RateEstimator()    # fed by getaltaz()
+        self.shadow = stateshadow.StateShadow()
+        self.scheduler = None       # started by the first timed move
+        self.motions = 0            # motion commands sent; see moved()
         if comport is not None:
             self.open(comport)
     
@@ -19,11 +34,16 @@ class Meade:
         return self.ready
     
     def open(self,comport):
-        """Open a serial connection on port comport.  Sends "wake" and "align status"
+        """Open a serial connection on port comport (a port name, or an open
+        serialdev.SerialPort-like object).  Sends "wake" and "align status"
         commands to the scope, enters high precision coordinate mode."""
         self.ready = False
+        self.shadow.forget()
         try:
-            self.ser = serial.Serial(comport,9600,timeout=2)
+            if hasattr(comport,'transact'):     # already a port, e.g. a serialtrace.ReplayPort
+                self.ser = comport
+            else:
+                self.ser = serialdev.SerialPort(comport,9600,timeout=2)
             self.ready = True
         except:
             print('Failed to open serial port ',comport)     
@@ -32,11 +52,11 @@ class Meade:
             # Send some greetings to the scope to wake it up
             self.ser.flushInput()
             self.ser.write(b':hW#')       # Wake up!
-            self.ser.write(b':GW#')       # Query alignment status
-            self.ser.flushInput()
-            self.ser.write(b':GW#')       # Query alignment status
-            resp = self.ser.read(4)
+            resp, = self.ser.transact(b':GW#',[4])       # Query alignment status
+            resp, = self.ser.transact(b':GW#',[4])       # Again, now it's awake
             print(resp)
+            if len(resp) >= 4:
+                self.shadow.observe('safe',resp[1:2] == b'N')
             if len(resp) < 3:
                 print('Meade telescope is not responding.')
                 self.ready = False
@@ -44,155 +64,272 @@ class Meade:
             else:
                 print('Meade telescope responded.')
                 self.ready = True
-                self.ser.flushInput()
-                self.ser.write(b':GD#')     # Get declination
-                resp = self.ser.read(10)
+                resp, = self.ser.transact(b':GD#',[10])     # Get declination
                 if len(resp) < 10:           # short declination returned
                     self.ser.write(b':U#')   # toggle precision
                 self.ser.flushInput()
     
     def close(self):
+        if self.scheduler is not None:      # timed moves still to come would write to a closed port
+            self.scheduler.shutdown()
+            self.scheduler.join(1.0)
+            self.scheduler = None
         try:
             self.ser.close()
         except:
             pass
         self.ready = False
 
-    def is_safe(self):
-        """ True if scope motors are disabled, tracking off."""
-        self.ser.flushInput()
-        self.ser.write(b':GW#')
-        response = self.ser.read(4)
+    def is_safe(self,refresh=False):
+        """ True if scope motors are disabled, tracking off.  Answered from the
+        state shadow if known, unless refresh is True."""
+        if not refresh and self.shadow.known('safe'):
+            return self.shadow.recall('safe')
+        response, = self.ser.transact(b':GW#',[4])
 	    
         if (len(response) < 4):
             print('No response from telescope.  Check communications.')
         elif response[1:2] ==b'N':
+            self.shadow.observe('safe',True)
             return True
         elif response[1:2] ==b'T':
+            self.shadow.observe('safe',False)
             return False
         else:
-            print('Unexpected response from telescope:')
-            response
+            print('Unexpected response from telescope:',response)
+            stats.recorder.error(b':GW#')
             return False
 
     def set_safe(self,safe):
         """ Set safe=True to put telescope into sleep mode (motors and displays
         powered off); safe=False to put the telescope into active tracking mode.
         Kludge for safe=True: to start up tracking motors, telescope does a GOTO
-        to its current position."""
+        to its current position.  Neither command is acknowledged, so the
+        state shadow forgets whether the scope is safe."""
+        self.moved()
         self.ser.flushInput()
         if not safe:
             self.ser.write(b':hW#') # Wake scope
             print('Waking scope')
             time.sleep(1)
-            if self.is_safe(): # scope is not tracking
+            if self.is_safe(refresh=True): # scope is not tracking
                 pos = self.getposition()
                 self.goto(pos)
                 print('GOTO to enable tracking.')
         else: # Sleep scope
             self.ser.write(b':hN#')
             print('Putting scope to sleep.')
+        self.shadow.forget('safe')
         
     def setstarlock(self,dostarlock):
         """ Set dostarlock=true to engage Starlock autoguiding."""
+        if not self.shadow.needed('starlock',dostarlock):
+            return
         self.ser.flushInput()
         if dostarlock:
             self.ser.write(b':MgS1#')
         else:
             self.ser.write(b':MgS0#')
+        self.shadow.acknowledge('starlock',dostarlock)
 
     def sethighprecision(self,dohighprecision):
-        """ Set dohighprecision=true to turn on high precision pointing."""
-        self.ser.flushInput()
-        self.ser.write(b':P#')  # Toggle high precision, can't be sure which way.
-        resp = self.ser.read(14)
+        """ Set dohighprecision=true to turn on high precision pointing.  The scope
+        only has a toggle, but says which way it went."""
+        if not self.shadow.needed('highprecision',dohighprecision):
+            return
+        resp, = self.ser.transact(b':P#',[14],terminator=None)  # Toggle high precision, can't be sure which way.
         if (len(resp)> 1):
-            if (dohighprecision and (resp[0] == 'L')) or (not dohighprecision and (resp[0] == 'H')):  # Wrong precision
-                self.ser.write(b':P#') # Retoggle.
+            self.shadow.toggled('highprecision',resp[0:1] == b'H')
+            if self.shadow.get('highprecision') != dohighprecision:  # Wrong precision
+                resp, = self.ser.transact(b':P#',[14],terminator=None) # Retoggle.
+                if len(resp) > 1:
+                    self.shadow.toggled('highprecision',resp[0:1] == b'H')
+                else:
+                    self.shadow.forget('highprecision')
         else:
+            self.shadow.forget('highprecision')
             print('No response from scope')
 
+    def query(self,*cmds):
+        """Send the '#'-terminated queries cmds (see REPLYLENGTHS) in one burst, and
+        return their replies in the same order.  A reply that doesn't arrive in
+        time comes back short, and the ones after it empty."""
+        return self.ser.transact(list(cmds),[self.REPLYLENGTHS.get(cmd,64) for cmd in cmds])
+
     def getposition(self,dump=False):
         """Request current telescope position.  Result is returned as a
-        RADec object (see radec.py)"""
-        self.ser.flushInput()
-        self.ser.write(b':GD#')         # get declination
-        decresp = self.ser.read(10)
-        self.ser.write(b':GR#')         # get right ascension
-        raresp = self.ser.read(9)
+        RADec object (see radec.py), or None if the scope's reply can't be read.
+        RA and dec are requested together, so they describe the same moment."""
+        raresp,decresp = self.query(b':GR#',b':GD#')
         if dump:
             print('RA: ',raresp,' Dec: ',decresp)
         try:
             pos = radec.RADec.fromMeade(raresp,decresp)
+        except ValueError:
+            print('Unexpected response from telescope:',raresp,decresp)
+            stats.recorder.error(b':GR#' if len(raresp) < 9 or not raresp.endswith(b'#') else b':GD#')
+            return None
+        self.rates.add(pos)
+        return pos
+
+    def getversion(self):
+        """Firmware version, as a string, or None if the scope doesn't say."""
+        resp, = self.query(b':GVN#')
+        if not resp.endswith(b'#'):
+            return None
+        return resp[:-1].decode('ascii','replace')
+
+    def status(self):
+        """Refresh everything about the scope in one serial burst.  Returns a dict:
+        'position': RADec object (or None), 'mount': b'A' (alt-az), b'P' (polar)
+        or b'G' (German equatorial), 'safe': True if not tracking, 'aligned':
+        alignment stars used, 'altitude' and 'azimuth': decimal degrees (or None).
+        Items the scope didn't answer are None."""
+        raresp,decresp,alignresp,azmresp,altresp = self.query(b':GR#',b':GD#',b':GW#',b':GZ#',b':GA#')
+        status = dict(position=None,mount=None,safe=None,aligned=None,altitude=None,azimuth=None)
+        try:
+            status['position'] = radec.RADec.fromMeade(raresp,decresp)
+            self.rates.add(status['position'])
+        except ValueError:
+            pass
+        if len(alignresp) >= 4:
+            status['mount'] = alignresp[0:1]
+            status['safe'] = alignresp[1:2] == b'N'
+            status['aligned'] = alignresp[2]-0x30
+        try:
+            status['altitude'] = radec.decode_meade_dec(altresp)
+            status['azimuth'] = radec.decode_meade_azimuth(azmresp)
         except ValueError:
             pass
-        return radec.RADec.fromMeade(raresp,decresp)
+        return status
 
     def getaltaz(self,dump=False):
         """Request current telescope alt/az position.  Result is returned as a
-        RADec object (see radec.py)"""
-        self.ser.flushInput()
-        self.ser.write(b':GZ#')         # get azimuth
-        azmresp = self.ser.read(10)
-        self.ser.write(b':GR#')         # get altitude
-        altresp = self.ser.read(9)
+        RADec object (see radec.py) holding azimuth, in hours like NexStar's,
+        and altitude in degrees, or None if the scope's reply can't be read.
+        Both are requested together, so they describe the same moment."""
+        azmresp,altresp = self.query(b':GZ#',b':GA#')
         if dump:
             print('Az: ',azmresp,' Alt: ',altresp)
-        return radec.RADec.fromMeade(azmresp,altresp)
+        try:
+            pos = radec.RADec((radec.decode_meade_azimuth(azmresp)/15,radec.decode_meade_dec(altresp)))
+        except ValueError:
+            print('Unexpected response from telescope:',azmresp,altresp)
+            stats.recorder.error(b':GZ#' if len(azmresp) < 10 or not azmresp.endswith(b'#') else b':GA#')
+            return None
+        self.altazrates.add(pos)
+        return pos
+
+    def moved(self):
+        """Note that a command has changed how the scope moves, so positions
+        measured before it can't be extrapolated past it (see
+        positioncache.PositionCache)."""
+        self.motions += 1
+
+    def _move(self,cmd):
+        """Send motion command cmd."""
+        self.moved()
+        self.ser.write(cmd)
 
     def stop(self):
         """Stop all telescope motion."""
+        self.moved()
         self.ser.flushInput()
         self.ser.write(b':Q#')
 
-    def setrate(self,speed):
-        """ Set slewing rate.  For Meade, there are four default rates, but for compatibility 
-        we allow speeds from 0 to 9."""
+    @staticmethod
+    def ratecmd(speed):
+        """ Rate command for slewing speed.  For Meade, there are four default rates,
+        but for compatibility we allow speeds from 0 to 9."""
         rate = int(((speed+1)*4)/10)
         rate = min(max(rate,0),3)         # Speed limit
-        if (rate == 0):
-            self.ser.write(b':RG#')
-        elif (rate == 1):
-            self.ser.write(b':RC#')
-        elif (rate == 2):
-            self.ser.write(b':RM#')
-        elif (rate == 3):
-            self.ser.write(b':RS#')
+        return (b':RG#',b':RC#',b':RM#',b':RS#')[rate]
+
+    def setrate(self,speed):
+        """ Set slewing rate.  For Meade, there are four default rates, but for compatibility 
+        we allow speeds from 0 to 9.  Not sent if the rate is already set."""
+        cmd = self.ratecmd(speed)
+        if self.shadow.needed('rate',cmd):
+            self.ser.write(cmd)
+            self.shadow.acknowledge('rate',cmd)
     
     def sleweast(self,speed):
         """Slew telescope east.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
         self.setrate(speed)
-        self.ser.write(b':Me#')
+        self._move(b':Me#')
 
     def slewwest(self,speed):
         """Slew telescope west.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
         self.setrate(speed)
-        self.ser.write(b':Mw#')
+        self._move(b':Mw#')
 
     def slewnorth(self,speed):
         """Slew telescope north.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
         self.setrate(speed)
-        self.ser.write(b':Mn#')
+        self._move(b':Mn#')
 
     def slewsouth(self,speed):
         """Slew telescope south.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
         self.setrate(speed)
-        self.ser.write(b':Ms#')
+        self._move(b':Ms#')
+
+    # Pulse guide and stop commands for each direction
+    GUIDECMDS = {'n':b':Mgn%04d#', 's':b':Mgs%04d#', 'e':b':Mge%04d#', 'w':b':Mgw%04d#'}
+    SLEWCMDS = {'n':b':Mn#', 's':b':Ms#', 'e':b':Me#', 'w':b':Mw#'}
+    QUITCMDS = {'n':b':Qn#', 's':b':Qs#', 'e':b':Qe#', 'w':b':Qw#'}
+
+    def pulseguide(self,direction,ms):
+        """Guide in direction 'n', 's', 'e' or 'w' for ms milliseconds (up to 9999),
+        at the guide rate.  The scope times the pulse itself."""
+        ms = min(max(int(round(ms)),0),9999)
+        self._move(self.GUIDECMDS[direction] % ms)
+
+    def guide(self,corrections):
+        """Apply a batch of guiding corrections, a list of (direction, ms) pairs
+        (see pulseguide()).  Corrections on the same axis are netted out, and the
+        resulting RA and dec pulses go out together in one write, so both axes
+        move at once."""
+        net = {'n':0,'e':0}
+        for direction,ms in corrections:
+            if direction in ('n','e'):
+                net[direction] += ms
+            else:
+                net['n' if direction == 's' else 'e'] -= ms
+        cmd = b''
+        for direction,opposite in (('e','w'),('n','s')):
+            ms = min(int(round(abs(net[direction]))),9999)
+            if ms:
+                cmd += self.GUIDECMDS[direction if net[direction] > 0 else opposite] % ms
+        if cmd:
+            self._move(cmd)
+
+    def _schedule(self,delay,send,cmd):
+        """Send cmd with send(cmd) delay seconds from now, timed by the scheduler
+        thread."""
+        if self.scheduler is None:
+            self.scheduler = scheduler.MotionScheduler()
+        return self.scheduler.after(delay,send,cmd)
+
+    def timedslew(self,direction,speed,seconds):
+        """Slew in direction 'n', 's', 'e' or 'w' at speed (0-9, see sleweast())
+        for seconds, stopping that direction only.  Returns a scheduler.Job
+        that is done when the stop command has been sent."""
+        self.setrate(speed)
+        self._move(self.SLEWCMDS[direction])
+        return self._schedule(seconds,self._move,self.QUITCMDS[direction])
 
     def settarget(self,pos):
         """Set target position for goto or sync"""
         print('Setting target position to',pos.ra(),pos.dec())
         (meadera,meadedec) = pos.toMeade()
-        self.ser.write(b':Sr'+meadera)
-        resp = self.ser.read(1)
+        resp, = self.ser.transact(b':Sr'+meadera,[1],terminator=None)
         if not int(resp):
             raise ValueError('Right ascension not accepted by telescope.')
-        self.ser.write(b':Sd'+meadedec)
-        resp = self.ser.read(1)
+        resp, = self.ser.transact(b':Sd'+meadedec,[1],terminator=None)
         if not int(resp):
             raise ValueError('Declination not accepted by telescope.')
 
@@ -202,8 +339,8 @@ class Meade:
         pos must be a RADec object (see radec.py)"""
         self.settarget(pos)
         print('Moving scope to ',pos.ra(),pos.dec())
-        self.ser.write(b':MS#')
-        resp = self.ser.read(1)
+        self.moved()
+        resp, = self.ser.transact(b':MS#',[1],terminator=None)
         if len(resp) > 0:            
             if int(resp) > 0:
                 print('Object below horizon limits.')
@@ -237,25 +374,32 @@ class Meade:
         return self.ser.read(bytecount)
 
     def getrate(self):
-        """Scope motion rate, in arcseconds/second"""
-        startpos = self.getposition()
-        time.sleep(5)
-        endpos = self.getposition()
-        return ((endpos[0]-startpos[0])*3600/5,(endpos[1]-startpos[1])*3600/5)
+        """Scope motion rate, in arcseconds/second, fitted to the positions
+        getposition() has returned over the last 10 seconds.  Doesn't talk to the
+        scope, so poll first; None until there are two recent positions."""
+        rate = self.rates.rate()
+        return None if rate is None else rate[0:2]
     
     def getaltazrate(self):
-        """Scope motion rate, in arcseconds/second"""
-        startpos = self.getaltaz()
-        time.sleep(5)
-        endpos = self.getaltaz()
-        return ((endpos[0]-startpos[0])*3600/5,(endpos[1]-startpos[1])*3600/5)
+        """Scope motion rate, in arcseconds/second, fitted to the positions
+        getaltaz() has returned over the last 10 seconds.  None until there are
+        two recent positions."""
+        rate = self.altazrates.rate()
+        return None if rate is None else rate[0:2]
 
-    def focus(self,time):   ### DOES NOT WORK
+    def focus(self,time):
+        """Move the focuser for time milliseconds: inward if time is positive,
+        outward if negative.  Limited to 65 seconds.  Returns a scheduler.Job (see
+        timedfocus())."""
         time = min(max(time,-65000),65000)  # Limit 65000 ms focus
-        focusmsg = (':FP%+d#'%time).encode()
-        self.ser.flush()
-        print(focusmsg)
-        self.ser.write(focusmsg)
+        return self.timedfocus(time > 0,abs(time)/1000.)
+
+    def timedfocus(self,inward,seconds):
+        """Move the focuser inward (inward=True) or outward for seconds, at the
+        current focuser speed.  Returns a scheduler.Job that is done when the
+        halt command has been sent."""
+        self.ser.write(b':F+#' if inward else b':F-#')
+        return self._schedule(seconds,self.ser.write,b':FQ#')
 
     def focusin(self):
         """Start focuser moving  inward"""
@@ -277,6 +421,10 @@ class Meade:
         self.ser.write(b':FQ#')
         
     def focusspeed(self,speed):
+        """Set focuser speed, 1 (slow) to 4 (fast).  Not sent if already set."""
         speed = min(max(speed,1),4)
+        if not self.shadow.needed('focusspeed',speed):
+            return
         self.ser.flush()
         self.ser.write((':F%1d#'%speed).encode())
+        self.shadow.acknowledge('focusspeed',speed)
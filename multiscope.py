@@ -0,0 +1,215 @@
+""" MultiScopeServer: one Stellarium server for several telescopes.
+
+Each telescope gets its own pair of Stellarium ports (GOTO and SYNC), bound
+to its own driver, so a planetarium can be pointed at any mount on the host.
+The sockets for every telescope are served from one event loop; each scope
+is polled by its own thread at its own rate, so a slow serial link or a long
+GOTO on one mount doesn't hold up the others' position feeds.
+
+Run from the command line, one argument per telescope:
+
+    python multiscope.py nexstar:/dev/ttyUSB0:10001:10002 meade:/dev/ttyUSB1:10003:10004:0.5
+
+giving the driver, the serial port, the GOTO and SYNC ports and, optionally,
+the seconds between position polls (default 1).  Add --host ADDRESS to listen
+somewhere other than 127.0.0.1."""
+
+import queue
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import meade
+import nexstar
+import positioncache
+import stellariumserver
+import syncguard
+
+class ScopeFeed(threading.Thread):
+    """Polls one telescope, scope (a nexstar.NexStar or meade.Meade), every
+    interval seconds, and runs the GOTO and SYNC commands sent to it, all from
+    its own thread.  Positions are handed to post(feed, pos, type).  SYNCs must
+    pass the same checks as in the UI (see syncguard.SyncGuard), and are only
+    echoed to Stellarium once sent.  A command or poll that fails is reported
+    and counted in errors, and the feed carries on, so a scope that comes back
+    is picked up again."""
+
+    def __init__(self,name,scope,server,post,interval=1.0):
+        threading.Thread.__init__(self,name='ScopeFeed '+name,daemon=True)
+        self.scope = scope
+        self.server = server
+        self.post = post
+        self.interval = interval
+        self.position = positioncache.PositionCache(scope,ttl=interval)
+        self.syncguard = syncguard.SyncGuard()
+        self.commands = queue.Queue()
+        self.running = True
+        self.polls = 0
+        self.errors = 0         # commands and polls that raised
+
+    def goto(self,pos):
+        self.commands.put(('GOTO',pos))
+
+    def sync(self,pos):
+        self.commands.put(('SYNC',pos))
+
+    def stop(self):
+        self.running = False
+        self.commands.put(None)
+
+    def run(self):
+        due = time.monotonic()
+        while self.running:
+            try:
+                command = self.commands.get(timeout=max(due-time.monotonic(),0))
+            except queue.Empty:
+                command = None
+            if command is not None:
+                kind,pos = command
+                try:
+                    if kind == 'GOTO':
+                        self.scope.goto(pos)
+                    else:
+                        sync,message = self.syncguard.check(self.scope,pos)
+                        if message is not None:
+                            print(self.name+':',message)
+                        if sync:
+                            self.scope.sync(pos)
+                            self.post(self,pos,'SYNC')
+                except Exception as e:     # e.g. SerialException: the scope was unplugged
+                    self.errors += 1
+                    print(self.name+':',kind,'failed:',e)
+            if not self.running:
+                return
+            if time.monotonic() >= due:
+                due += self.interval
+                if due < time.monotonic():      # fell behind: don't try to catch up
+                    due = time.monotonic()+self.interval
+                try:
+                    pos = self.position.poll()
+                except Exception as e:
+                    self.errors += 1
+                    print(self.name+': polling failed:',e)
+                    continue
+                self.polls += 1
+                if pos is not None:
+                    self.post(self,pos,'GOTO')
+
+class MultiScopeServer:
+    """Stellarium ports for several telescopes, on host, served from one
+    selector.  add() each telescope, then run() (or step() from your own
+    loop)."""
+
+    def __init__(self,host='127.0.0.1',log=print):
+        self.host = host
+        self.log = log          # for Stellarium clients connecting and leaving
+        self.selector = selectors.DefaultSelector()
+        self.feeds = {}
+        self.positions = queue.Queue()          # (feed, pos, type) from the feeds
+        self.wakeup,self.waker = socket.socketpair()
+        self.wakeup.setblocking(0)
+        self.waker.setblocking(0)
+        self.selector.register(self.wakeup,selectors.EVENT_READ,None)
+        self.running = False
+
+    def add(self,name,scope,gotoport,syncport,interval=1.0):
+        """Serve telescope scope, called name, on Stellarium ports gotoport and
+        syncport, polling it every interval seconds.  Returns its ScopeFeed."""
+        server = stellariumserver.StellariumServer(self.host,gotoport,syncport,selector=self.selector,
+                                                   log=self.log)
+        feed = ScopeFeed(name,scope,server,self.post,interval)
+        self.feeds[server] = feed
+        feed.start()
+        return feed
+
+    def post(self,feed,pos,type):
+        """Called from a feed's thread: queue pos for its Stellarium clients, and
+        wake the event loop."""
+        self.positions.put((feed,pos,type))
+        try:
+            self.waker.send(b'x')
+        except BlockingIOError:
+            pass        # the loop has wakeups waiting already
+
+    def step(self,timeout=None):
+        """Wait up to timeout seconds (None: until something happens) for socket
+        events or new positions, and deal with them."""
+        for key,events in self.selector.select(timeout):
+            if key.data is None:
+                try:
+                    while self.wakeup.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+                continue
+            server,target = key.data
+            stellpos = server.handle(target,events)
+            if stellpos is not None:
+                if target.kind == 'GOTO':
+                    self.feeds[server].goto(stellpos)
+                else:
+                    self.feeds[server].sync(stellpos)
+        while True:
+            try:
+                feed,pos,type = self.positions.get_nowait()
+            except queue.Empty:
+                break
+            feed.server.send(pos,type=type)
+
+    def run(self):
+        """Serve until stop() is called from another thread."""
+        self.running = True
+        while self.running:
+            self.step(1.0)
+
+    def stop(self):
+        self.running = False
+        try:
+            self.waker.send(b'x')
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        for server,feed in self.feeds.items():
+            feed.stop()
+            feed.join(2.0)
+            server.close()
+            if feed.is_alive():     # stuck in a serial exchange: leave it the port
+                print(feed.name+' did not stop; not closing its port.')
+            else:
+                feed.scope.close()
+        self.feeds = {}
+        self.selector.unregister(self.wakeup)
+        self.wakeup.close()
+        self.waker.close()
+        self.selector.close()
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    host = '127.0.0.1'
+    if '--host' in args:
+        i = args.index('--host')
+        host = args[i+1]
+        del args[i:i+2]
+    if not args:
+        print('Usage: python multiscope.py [--host ADDRESS] DRIVER:SERIALPORT:GOTOPORT:SYNCPORT[:INTERVAL] ...')
+        sys.exit(1)
+    server = MultiScopeServer(host)
+    for arg in args:
+        fields = arg.split(':')
+        driver,port,gotoport,syncport = fields[0].lower(),fields[1],int(fields[2]),int(fields[3])
+        interval = float(fields[4]) if len(fields) > 4 else 1.0
+        scope = nexstar.NexStar(port) if driver == 'nexstar' else meade.Meade(port)
+        if not scope.ready:
+            print('No telescope on',port)
+            continue
+        server.add(port,scope,gotoport,syncport,interval)
+        print('Serving',driver,'on',port,'at Stellarium ports',gotoport,'and',syncport)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -2,11 +2,54 @@
 Serial port must be passed in at instance creation."""
 
 import serial
+import serialdev
 import radec
+import rateestimator
+import stateshadow
+import stats
 import time
+import threading
+
+class CommandQueue:
+    """Pipelines NexStar commands on one serial port.  Every NexStar command has
+    a reply of known length ending in '#', so several commands can go out in one
+    write and their replies be read back as they arrive and matched to the
+    commands in order, instead of waiting out a round trip per command.
+
+    Replies are read by length, not up to the '#': they are binary, and a data
+    byte of 0x23 (a version number, an echoed '#', passthrough data) would end
+    the read early and shift every reply after it."""
+
+    # Reply length in bytes for each opcode, including the trailing '#'.
+    REPLYLENGTHS = {b'e':18, b'z':18, b't':2, b'T':1, b'r':1, b's':1, b'u':1,
+                    b'K':2, b'V':3}
+
+    def __init__(self,ser):
+        self.ser = ser
+        self.lock = threading.Lock()
+
+    @classmethod
+    def replylength(cls,cmd):
+        """Expected reply length for command cmd.  Passthrough ('P') commands say
+        how many bytes of data they expect back, before the '#'."""
+        opcode = cmd[0:1]
+        if opcode == b'P':
+            return cmd[7]+1
+        return cls.REPLYLENGTHS[opcode]
+
+    def transact(self,*cmds):
+        """Send commands cmds back to back, and return a list of their replies in
+        the same order.  If the scope stops answering, the last replies come
+        back short or empty."""
+        lengths = [self.replylength(cmd) for cmd in cmds]
+        with self.lock:
+            return self.ser.transact(list(cmds),lengths,terminator=None)
 
 class NexStar:
 
+    MAXRATE = 16383     # Fastest variable slew rate, arcseconds/second (about 4.5 degrees/second)
+    CANSYNC = True      # see syncguard.SyncGuard
+
     def unsigned_to_signed_int(x):
         if x>0x7FFFFFFF:
             x=-int(0x100000000-x)
@@ -14,6 +57,11 @@ class NexStar:
     
     def __init__(self,comport=None):
         self.ready = False
+        self.version = None
+        self.rates = rateestimator.RateEstimator()         # fed by getposition()
+        self.altazrates = rateestimator.RateEstimator()    # fed by getaltaz()
+        self.shadow = stateshadow.StateShadow()
+        self.motions = 0            # motion commands sent; see moved()
         if comport is not None:
             self.open(comport)
             
@@ -24,23 +72,29 @@ class NexStar:
         return self.ready
     
     def open(self,comport):
-        """Open a serial connection on port comport.  Sends "are you
-        there" messages to verify connection to a NexStar-compatible scope."""
+        """Open a serial connection on port comport (a port name, or an open
+        serialdev.SerialPort-like object).  Sends "are you there" messages to
+        verify connection to a NexStar-compatible scope."""
         self.ready = False
+        self.shadow.forget()
         try:
-            self.ser = serial.Serial(comport,9600,timeout=1)
+            if hasattr(comport,'transact'):     # already a port, e.g. a serialtrace.ReplayPort
+                self.ser = comport
+            else:
+                self.ser = serialdev.SerialPort(comport,9600,timeout=1)
+            self.queue = CommandQueue(self.ser)
             self.ready = True
         except:
             print('Failed to open serial port ',comport)     
             self.ready = False
         if self.ready:
-            # Send some greetings to the scope to wake it up
-            self.ser.write(b'V')       # Scope version
-            resp = self.ser.read(3)
-            self.ser.write(b'V')
-            resp = self.ser.read(3)
-            self.ser.write(b'Kq')      # Ask scope to echo "q"
-            resp = self.ser.read(2)
+            # Send some greetings to the scope to wake it up.  One at a time: a
+            # sleepy scope may miss the first, which would muddle a pipeline.
+            resp, = self.queue.transact(b'V')       # Scope version
+            resp, = self.queue.transact(b'V')
+            if len(resp) == 3:
+                self.version = '%d.%d' % (resp[0],resp[1])
+            resp, = self.queue.transact(b'Kq')      # Ask scope to echo "q"
             if not(resp == b'q#'):
                 print('NexStar telescope is not responding.')
                 self.ready = False
@@ -56,107 +110,97 @@ class NexStar:
             pass
         self.ready = False
 
-    def is_safe(self):
-        """ True if scope motors are disabled, tracking off."""
-        self.ser.flushInput()
-        self.ser.write(b't')
-        response = self.ser.read(2)
+    def is_safe(self,refresh=False):
+        """ True if scope motors are disabled, tracking off.  Answered from the
+        state shadow if known, unless refresh is True."""
+        if not refresh and self.shadow.known('safe'):
+            return self.shadow.recall('safe')
+        response, = self.queue.transact(b't')
 	    
         if (len(response) < 2):
             print('No response from telescope.  Check communications.')
         elif response[0] == 0:
+            self.shadow.observe('safe',True)
             return True
         elif response[0] > 0:
+            self.shadow.observe('safe',False)
             return False
         else:
-            print('Unexpected response from telescope:')
-            response
+            print('Unexpected response from telescope:',response)
+            stats.recorder.error(b't')
             return False
 
     def set_safe(self,safe):
         """ Set safe=True to put telescope into sleep mode (motors and displays
         powered off); safe=False to put the telescope into active tracking mode."""
-        self.ser.flushInput()
+        self.moved()
         if safe:
-            self.ser.write(b'T\x00')
+            response, = self.queue.transact(b'T\x00')
         else:
-            self.ser.write(b'T\x02')
-#            self.ser.write(b'T\x01')   # for southern hemisphere
-        response = self.ser.read(1)
+            response, = self.queue.transact(b'T\x02')
+#            response, = self.queue.transact(b'T\x01')   # for southern hemisphere
         print(response)
+        if response == b'#':
+            self.shadow.acknowledge('safe',bool(safe))
+        else:
+            self.shadow.forget('safe')
 
     def getposition(self,dump=False):
         """Request current telescope position.  Result is returned as a
         RADec object (see radec.py)"""
-        self.ser.flushInput()
-        self.ser.write(b'e')
-        response = self.ser.read(18)
+        response, = self.queue.transact(b'e')
         if dump:
             print(response)
         if (len(response)<18):
-            print('Unexpected response from telescope:')
-            response
+            print('Unexpected response from telescope:',response)
+            stats.recorder.error(b'e')
             return None
-        return radec.RADec.fromNexstar(response)
+        pos = radec.RADec.fromNexstar(response)
+        self.rates.add(pos)
+        return pos
 
     def getaltaz(self,dump=False):
         """Request current telescope alt/az position.  Result is returned as a
         RADec object (see radec.py)"""
-        self.ser.flushInput()
-        self.ser.write(b'z')
-        response = self.ser.read(18)
+        response, = self.queue.transact(b'z')
         if dump:
             print(response)
         if (len(response)<18):
-            print('Unexpected response from telescope:')
-            response
+            print('Unexpected response from telescope:',response)
+            stats.recorder.error(b'z')
             return None
-        return radec.RADec.fromNexstar(response)
+        pos = radec.RADec.fromNexstar(response)
+        self.altazrates.add(pos)
+        return pos
 
     def stop(self):
-        """Stop all telescope motion by setting motor speed to zero."""
-        self.sleweast(0)
-        return self.slewnorth(0)
+        """Stop all telescope motion by setting motor speed to zero.  Both axes
+        are stopped in one pipelined exchange."""
+        self.command(self.slewcmd(16,37,0),self.slewcmd(17,36,0))
     
     def sleweast(self,speed):
         """Slew telescope east.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
-        speed = min(max(int(speed),0),9)            
-        cmd = b'P'+bytes([2,16,37,speed,0,0,0])
-        self.ser.flushInput()
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(self.slewcmd(16,37,speed))
 
     def slewwest(self,speed):
         """Slew telescope west.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!"""
-        speed = min(max(int(speed),0),9)            
-        cmd = b'P'+bytes([2,16,36,speed,0,0,0])
-        self.ser.flushInput()
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(self.slewcmd(16,36,speed))
 
     def slewnorth(self,speed):
         """Slew telescope north.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!
         Note: slewnorth() goes north if telescope is pointed east; goes south
         if telescope is pointed west.  Don't blame me, blame Celestron."""
-        speed = min(max(int(speed),0),9)            
-        cmd = b'P'+bytes([2,17,36,speed,0,0,0])
-        self.ser.flushInput()
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(self.slewcmd(17,36,speed))
     
     def slewsouth(self,speed):
         """Slew telescope south.  Speed should be between 0 (stopped) and 9
         (maximum slew rate).  Motion will continue until stop() is called!
         Note: slewsouth() goes south if telescope is pointed east; goes north
         if telescope is pointed west.  Don't blame me, blame Celestron."""
-        speed = min(max(int(speed),0),9)            
-        cmd = b'P'+bytes([2,17,37,speed,0,0,0])
-        self.ser.flushInput()
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(self.slewcmd(17,37,speed))
 
     def goto(self,pos):
         """Command telescope to GOTO position pos.
@@ -165,9 +209,7 @@ class NexStar:
         nspos = pos.toNexstar()
         cmd = b'r'+nspos
         print(cmd)
-        self.ser.flushInput()       
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(cmd)
 
     def sync(self,pos):
         """Command telescope to SYNC on position pos.
@@ -176,26 +218,63 @@ class NexStar:
         nspos = pos.toNexstar()
         cmd = b's'+nspos
         print(cmd)
-        self.ser.flushInput()       
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(cmd)
 
     def undosync(self):
         """Command telescope to clear SYNC"""
         print('Clearing SYNC')
         cmd = b'u'
         print(cmd)
-        self.ser.flushInput()       
-        self.ser.write(cmd)
-        self.listenforconfirm()
+        self.command(cmd)
+
+    @staticmethod
+    def slewcmd(axis,direction,speed):
+        """Fixed-rate passthrough slew command.  axis is 16 (RA/azimuth) or 17
+        (dec/altitude); direction is 36 (positive) or 37 (negative); speed is
+        clipped to 0 (stopped) to 9 (maximum slew rate)."""
+        speed = min(max(int(speed),0),9)
+        return b'P'+bytes([2,axis,direction,speed,0,0,0])
+
+    @staticmethod
+    def ratecmd(axis,rate):
+        """Variable-rate passthrough slew command.  axis is 16 (RA/azimuth) or 17
+        (dec/altitude); rate is in arcseconds/second, positive or negative, with a
+        resolution of 1/4 arcsecond/second, clipped to +/- MAXRATE."""
+        rate = min(max(rate,-NexStar.MAXRATE),NexStar.MAXRATE)
+        steps = int(round(abs(rate)*4))
+        direction = 6 if rate >= 0 else 7
+        return b'P'+bytes([3,axis,direction,steps >> 8,steps & 0xFF,0,0])
+
+    def move(self,eastrate,northrate):
+        """Slew both axes at once at variable rates, in arcseconds/second:
+        eastrate east (negative for west), northrate north (negative for south).
+        Both axis commands go out back to back in one exchange.  Motion will
+        continue until stop() or move(0,0) is called!  Like slewnorth(),
+        "north" is reversed when the telescope is pointed west."""
+        self.command(self.ratecmd(16,-eastrate),self.ratecmd(17,northrate))
+
+    def moved(self):
+        """Note that a command has changed how the scope moves, so positions
+        measured before it can't be extrapolated past it (see
+        positioncache.PositionCache)."""
+        self.motions += 1
+
+    def command(self,*cmds):
+        """Send motion commands cmds back to back through the command queue, and
+        return their replies.  Complains about any reply that comes back short."""
+        self.moved()
+        replies = self.queue.transact(*cmds)
+        for cmd,reply in zip(cmds,replies):
+            if len(reply) < CommandQueue.replylength(cmd):
+                print('Unexpected response from telescope:',cmd,reply)
+        return replies
 
     def listenforconfirm(self,numbytes=1):
         """Listen for confirmation from telescope.  No detailed parsing:
         just listens for any reply of length numbytes."""
-        response = self.ser.read(numbytes)
+        response = self.ser.readreply(numbytes,terminator=None)
         if (len(response)<numbytes):
-            print('Unexpected response from telescope:')
-            response
+            print('Unexpected response from telescope:',response)
 
     def write(self,data):
         """Send arbitrary data to the telescope."""
@@ -205,15 +284,15 @@ class NexStar:
         return self.ser.read(bytecount)
 
     def getrate(self):
-        """Scope motion rate, in arcseconds/second"""
-        startpos = self.getposition()
-        time.sleep(5)
-        endpos = self.getposition()
-        return ((endpos[0]-startpos[0])*3600/5,(endpos[1]-startpos[1])*3600/5)
+        """Scope motion rate, in arcseconds/second, fitted to the positions
+        getposition() has returned over the last 10 seconds.  Doesn't talk to the
+        scope, so poll first; None until there are two recent positions."""
+        rate = self.rates.rate()
+        return None if rate is None else rate[0:2]
     
     def getaltazrate(self):
-        """Scope motion rate, in arcseconds/second"""
-        startpos = self.getaltaz()
-        time.sleep(5)
-        endpos = self.getaltaz()
-        return ((endpos[0]-startpos[0])*3600/5,(endpos[1]-startpos[1])*3600/5)
\ No newline at end of file
+        """Scope motion rate, in arcseconds/second, fitted to the positions
+        getaltaz() has returned over the last 10 seconds.  None until there are
+        two recent positions."""
+        rate = self.altazrates.rate()
+        return None if rate is None else rate[0:2]
\ No newline at end of file
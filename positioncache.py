@@ -0,0 +1,132 @@
+""" PositionCache: a shared, short-lived memory of where the telescope is
+pointing, so that the UI, the Stellarium feed and scripts don't each pay for a
+serial round trip to ask.
+
+Positions younger than the cache's ttl (time to live, in seconds) are answered
+without touching the scope.  Between polls, the answer is extrapolated at the
+rate fitted to recent samples, so a slewing scope's position keeps moving.
+Once the scope is sent a motion command (stop, slew, goto, sync...), the
+samples from before it no longer say where it is going: the drivers count
+those commands, and the cache starts again when the count changes.  Call
+clear() to start again for any other reason."""
+
+import collections
+import threading
+import time
+
+import radec
+import rateestimator
+
+class PositionCache:
+    """Caches the position of scope, a nexstar.NexStar or meade.Meade object."""
+
+    def __init__(self,scope,ttl=1.0,clock=time.monotonic,ratewindow=5.0):
+        self.scope = scope
+        self.ttl = ttl
+        self.clock = clock
+        self.samples = collections.deque(maxlen=1)    # (time, RADec) of the newest sample
+        self.rates = rateestimator.RateEstimator(size=16,window=ratewindow,clock=clock)
+        self.lock = threading.Lock()
+        self.motions = self._motions()      # the scope's motion count the samples belong to
+        self.hits = 0
+        self.misses = 0
+
+    def _motions(self):
+        """The scope's count of motion commands (see NexStar.moved()), or 0 if it
+        doesn't keep one."""
+        motions = getattr(self.scope,'motions',0)
+        return motions if isinstance(motions,int) else 0
+
+    def _checkmotion(self):
+        """Start again if the scope has been sent a motion command since the
+        samples were taken."""
+        if self._motions() != self.motions:
+            self.clear()
+
+    def clear(self):
+        """Forget every sample, e.g. because the scope's motion has changed."""
+        with self.lock:
+            self.samples.clear()
+            self.motions = self._motions()
+        self.rates.clear()
+
+    def update(self,pos,when=None,motions=None):
+        """Record position pos, measured at time when (default: now), after the
+        scope's motions'th motion command (default: the latest).  Use this to
+        feed in positions read from the scope some other way."""
+        if pos is None:
+            return
+        if when is None:
+            when = self.clock()
+        if motions is None:
+            motions = self._motions()
+        if motions != self.motions:
+            self.clear()
+            if motions != self.motions:     # a sample from before the last motion command
+                return
+        with self.lock:
+            self.samples.append((when,pos))
+        self.rates.add(pos,when)
+
+    def poll(self,dump=False):
+        """Read the position from the scope now, record it, and return it."""
+        motions = self._motions()
+        pos = self.scope.getposition(dump=dump)
+        self.update(pos,motions=motions)
+        return pos
+
+    def rate(self):
+        """Current motion in (hours of RA, degrees of dec) per second, fitted to the
+        recent samples; (0,0) if there aren't two."""
+        rate = self.rates.rate()
+        if rate is None:
+            return (0.0,0.0)
+        return (rate[0]/3600,rate[1]/3600)
+
+    def age(self,when=None):
+        """Seconds since the last sample, or None if there hasn't been one."""
+        self._checkmotion()
+        with self.lock:
+            if not self.samples:
+                return None
+            last = self.samples[-1][0]
+        if when is None:
+            when = self.clock()
+        return when-last
+
+    def predict(self,when=None):
+        """Predicted position at time when (default: now), extrapolated from the
+        last samples, as a (RADec, age) pair, where age is how old the newest
+        sample is.  (None, None) if there are no samples."""
+        if when is None:
+            when = self.clock()
+        self._checkmotion()
+        with self.lock:
+            if not self.samples:
+                return (None,None)
+            last,pos = self.samples[-1]
+        age = when-last
+        rarate,decrate = self.rate()
+        if age <= 0 or (rarate == 0 and decrate == 0):
+            return (pos,age)
+        ra = (pos[0] + rarate*age) % 24
+        dec = min(max(pos[1] + decrate*age,-90.0),90.0)
+        return (radec.RADec((ra,dec)),age)
+
+    def lookup(self,maxage=None):
+        """Telescope position as a (RADec, age) pair.  If the newest sample is no
+        older than maxage seconds (default: the cache's ttl), the answer is
+        predicted from it; otherwise the scope is polled, and age is 0."""
+        if maxage is None:
+            maxage = self.ttl
+        pos,age = self.predict()
+        if pos is not None and age <= maxage:
+            self.hits += 1
+            return (pos,age)
+        self.misses += 1
+        return (self.poll(),0.0)
+
+    def getposition(self,dump=False):
+        """Telescope position as a RADec object, like the drivers' getposition(),
+        but answered from the cache when it is fresh enough."""
+        return self.lookup()[0]
@@ -1,12 +1,199 @@
 """ RADec:  A class to store and convert right ascension/declination
 coordinates """
 import struct
+import binascii
+
+try:
+    import numpy
+except ImportError:
+    numpy = None      # RADecArray needs numpy; RADec does not.
+
+class InternCache:
+    """A bounded table of RADec objects, so that a parked or tracking scope
+    reporting the same position over and over gets the same object back, with
+    its wire encodings already computed.
+
+    Takes no lock: dict lookups and setdefault() are atomic, so a hit costs one
+    dict lookup and a miss one more.  When full, the table is emptied and
+    starts again, which costs less than keeping it in least-recently-used
+    order on every lookup.  hits and misses are approximate when several
+    threads use it."""
+
+    def __init__(self,maxsize=256):
+        self.maxsize = maxsize
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,key):
+        obj = self.table.get(key)
+        if obj is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return obj
+
+    def add(self,key,obj):
+        """Store obj under key, emptying the table first if full.  If another
+        thread got there first, returns the object already stored."""
+        if len(self.table) >= self.maxsize:
+            self.table.clear()
+        return self.table.setdefault(key,obj)
+
+    def clear(self):
+        self.table.clear()
+
+# Interning is off by default: a moving scope rarely repeats a position, and
+# then every lookup is a miss.  For a parked scope, or many clients asking for
+# the same positions, turn it on with  radec.interned = radec.InternCache()
+interned = None
+
+"""Codec: parse and emit the telescope wire formats directly from and into byte
+buffers, with precompiled structs and lookup tables.  The RADec methods use
+these; call them directly to decode part of a larger buffer or to build a
+command in place."""
+
+NEXSTAR_LENGTH = 17         # b'RRRRRRRR,DDDDDDDD'
+MEADE_RA_LENGTH = 9         # b'HH:MM:SS#'
+MEADE_DEC_LENGTH = 10       # b'sDD*MM'SS#'
+
+_NEXSTAR_RAW = struct.Struct('>Ii')
+_NEXSTAR_PACK = struct.Struct('>II')
+_NEXSTAR_HEX = struct.Struct('2s2s2s2sB2s2s2s2s')
+_MEADE_RA = struct.Struct('3s3s3s')
+_MEADE_DEC = struct.Struct('B3s3s3s')
+_HEX = tuple(b'%02X' % i for i in range(256))
+# Two digits and the separator after them, so each field is one lookup
+_HOURS = tuple(b'%02d:' % i for i in range(100))
+_DEGREES = tuple(b'%02d*' % i for i in range(100))
+_ARCMINUTES = tuple(b"%02d'" % i for i in range(100))
+_SECONDS = tuple(b'%02d#' % i for i in range(100))
+_NOTDIGIT = bytes(0 if 0x30 <= c <= 0x39 else 1 for c in range(256))
+
+def decode_nexstar(buf,offset=0):
+    """Parse NexStar coordinates b'RRRRRRRR,DDDDDDDD' starting at buf[offset].
+    buf may be bytes or a bytearray.  Returns (decimal hours, decimal degrees).
+    See RADec.fromNexstar() for the format."""
+    if len(buf) < offset+NEXSTAR_LENGTH or buf[offset+8] != 0x2C:   # ','
+        raise ValueError("Invalid NexStar coordinate")
+    try:
+        intra,intdec = _NEXSTAR_RAW.unpack(binascii.a2b_hex(buf[offset:offset+8]+buf[offset+9:offset+17]))
+    except binascii.Error:
+        raise ValueError("Invalid NexStar coordinate")
+    return (intra*(24/0x100000000), intdec*(360/0x100000000))
+
+def encode_nexstar(rahrs,decdeg):
+    """NexStar coordinates b'RRRRRRRR,DDDDDDDD' for decimal hours and degrees."""
+    intra = int(0x100000000*rahrs/24) & 0xFFFFFFFF
+    intdec = int(0x100000000*decdeg/360) & 0xFFFFFFFF
+    return binascii.hexlify(_NEXSTAR_PACK.pack(intra,intdec),b',',4).upper()
+
+def encode_nexstar_into(buf,offset,rahrs,decdeg):
+    """Write NexStar coordinates into bytearray buf at offset.  Returns the offset
+    just past them."""
+    r0,r1,r2,r3,d0,d1,d2,d3 = _NEXSTAR_PACK.pack(int(0x100000000*rahrs/24) & 0xFFFFFFFF,
+                                                 int(0x100000000*decdeg/360) & 0xFFFFFFFF)
+    _NEXSTAR_HEX.pack_into(buf,offset,_HEX[r0],_HEX[r1],_HEX[r2],_HEX[r3],0x2C,
+                           _HEX[d0],_HEX[d1],_HEX[d2],_HEX[d3])
+    return offset+NEXSTAR_LENGTH
+
+def decode_meade_ra(buf,offset=0):
+    """Parse Meade right ascension b'HH:MM:SS#' starting at buf[offset].  Returns
+    decimal hours."""
+    if len(buf) < offset+MEADE_RA_LENGTH or buf[offset+2] != 0x3A or buf[offset+5] != 0x3A:   # ':'
+        raise ValueError("Invalid Meade right ascension.")
+    h1,h2,m1,m2,s1,s2 = buf[offset],buf[offset+1],buf[offset+3],buf[offset+4],buf[offset+6],buf[offset+7]
+    if _NOTDIGIT[h1] | _NOTDIGIT[h2] | _NOTDIGIT[m1] | _NOTDIGIT[m2] | _NOTDIGIT[s1] | _NOTDIGIT[s2]:
+        raise ValueError("Invalid Meade right ascension.")
+    return (h1*10+h2-528) + (m1*10+m2-528)/60 + (s1*10+s2-528)/3600
+
+def decode_meade_dec(buf,offset=0):
+    """Parse Meade declination b'sDD*MM'SS#' starting at buf[offset].  Returns
+    decimal degrees."""
+    if len(buf) < offset+MEADE_DEC_LENGTH:
+        raise ValueError("Invalid Meade declination.")
+    sign,d1,d2,m1,m2,s1,s2 = buf[offset],buf[offset+1],buf[offset+2],buf[offset+4],buf[offset+5], \
+                             buf[offset+7],buf[offset+8]
+    if (sign != 0x2B and sign != 0x2D) or \
+       _NOTDIGIT[d1] | _NOTDIGIT[d2] | _NOTDIGIT[m1] | _NOTDIGIT[m2] | _NOTDIGIT[s1] | _NOTDIGIT[s2]:
+        raise ValueError("Invalid Meade declination.")
+    decdeg = (d1*10+d2-528) + (m1*10+m2-528)/60. + (s1*10+s2-528)/3600.
+    if sign == 0x2D:   # '-'
+        decdeg = -decdeg
+    return decdeg
+
+def decode_meade_azimuth(buf,offset=0):
+    """Parse Meade azimuth b'DDD*MM'SS#' starting at buf[offset].  Returns
+    decimal degrees."""
+    if len(buf) < offset+MEADE_DEC_LENGTH:
+        raise ValueError("Invalid Meade azimuth.")
+    d1,d2,d3,m1,m2,s1,s2 = buf[offset],buf[offset+1],buf[offset+2],buf[offset+4],buf[offset+5], \
+                           buf[offset+7],buf[offset+8]
+    if _NOTDIGIT[d1] | _NOTDIGIT[d2] | _NOTDIGIT[d3] | _NOTDIGIT[m1] | _NOTDIGIT[m2] | _NOTDIGIT[s1] | _NOTDIGIT[s2]:
+        raise ValueError("Invalid Meade azimuth.")
+    return (d1*100+d2*10+d3-5328) + (m1*10+m2-528)/60. + (s1*10+s2-528)/3600.
+
+def _hms(value):
+    """Split non-negative decimal value into (whole, minutes, seconds), truncating
+    like RADec.ra_hms().  Raises ValueError if whole has more than two digits."""
+    whole = int(value)
+    if whole >= 100:
+        raise ValueError("Coordinate out of range for Meade format.")
+    decimal_mins = (value - whole)*60
+    mins = int(decimal_mins)
+    return (whole, mins, int((decimal_mins-mins)*60))
+
+def encode_meade_ra_into(buf,offset,rahrs):
+    """Write Meade right ascension b'HH:MM:SS#' into bytearray buf at offset.
+    Returns the offset just past it."""
+    if rahrs < 0:
+        raise ValueError("Right ascension out of range for Meade format.")
+    h,m,s = _hms(rahrs)
+    _MEADE_RA.pack_into(buf,offset,_HOURS[h],_HOURS[m],_SECONDS[s])
+    return offset+MEADE_RA_LENGTH
+
+def encode_meade_dec_into(buf,offset,decdeg):
+    """Write Meade declination b'sDD*MM'SS#' into bytearray buf at offset.
+    Returns the offset just past it."""
+    if decdeg < 0:          # the sign is written separately, so -0.5 stays south
+        d,m,s = _hms(-decdeg)
+        _MEADE_DEC.pack_into(buf,offset,0x2D,_DEGREES[d],_ARCMINUTES[m],_SECONDS[s])
+    else:
+        d,m,s = _hms(decdeg)
+        _MEADE_DEC.pack_into(buf,offset,0x2B,_DEGREES[d],_ARCMINUTES[m],_SECONDS[s])
+    return offset+MEADE_DEC_LENGTH
+
+def encode_meade_ra(rahrs):
+    """Meade right ascension b'HH:MM:SS#' for decimal hours."""
+    if rahrs < 0:
+        raise ValueError("Right ascension out of range for Meade format.")
+    h,m,s = _hms(rahrs)
+    return _HOURS[h]+_HOURS[m]+_SECONDS[s]
+
+def encode_meade_dec(decdeg):
+    """Meade declination b'sDD*MM'SS#' for decimal degrees."""
+    if decdeg < 0:
+        d,m,s = _hms(-decdeg)
+        return b'-'+_DEGREES[d]+_ARCMINUTES[m]+_SECONDS[s]
+    d,m,s = _hms(decdeg)
+    return b'+'+_DEGREES[d]+_ARCMINUTES[m]+_SECONDS[s]
 
 class RADec(tuple):
     
     """Internal storage format for RADec object: two floating-point numbers:
     self[0]: decimal hours of right ascension
-    self[1]: decimal degrees of declination"""
+    self[1]: decimal degrees of declination
+
+    RADec objects are immutable (ra,dec) tuples.  Each wire encoding and display
+    string is computed the first time it's asked for, then kept.  With
+    interning on (see interned), identical positions share one object."""
+
+    # Encodings not computed yet; computed ones are stored on the instance
+    _nexstar = None
+    _meade = None
+    _stellarium = None
+    _rastr = None
+    _decstr = None
 
     def unsigned_to_signed_int(x):
         """Convert unsigned integers to Python signed integers using
@@ -31,12 +218,33 @@ class RADec(tuple):
         else:
             return True
 
-    def __new__(cls,*args, **kw):
-        self = tuple.__new__(cls, *args, **kw)
+    def __new__(cls,pos):
+        cache = interned if cls is RADec else None
+        if cache is not None:
+            self = cache.get(pos if type(pos) is tuple else tuple(pos))
+            if self is not None:
+                return self
+        self = tuple.__new__(cls,pos)
+        if len(self) != 2:
+            raise ValueError("RADec needs exactly two coordinates.")
 #        if not self.valid():
 #            raise ValueError("RA or dec out of bounds.")
+        if cache is not None:
+            self = cache.add(self,self)
         return self
 
+    def __setattr__(self,name,value):
+        raise AttributeError("RADec objects are immutable.")
+
+    def __delattr__(self,name):
+        raise AttributeError("RADec objects are immutable.")
+
+    def __reduce__(self):
+        return (self.__class__, (tuple(self),))
+
+    def __repr__(self):
+        return 'RADec(%r)' % (tuple(self),)
+
     @classmethod
     def fromStellarium(cls,stellra,stelldec):
         """Create a RADec object from Stellarium's data format."""
@@ -53,9 +261,11 @@ class RADec(tuple):
         """Convert a RADec object to Stellarium's data format"""
 
         """See fromStellarium() for Stellarium data format."""
-        stellra = int(0x100000000*self[0]/24)
-        stelldec = int(0x40000000*self[1]/90)
-        return (stellra,stelldec)
+        if self._stellarium is None:
+            stellra = int(0x100000000*self[0]/24)
+            stelldec = int(0x40000000*self[1]/90)
+            self.__dict__['_stellarium'] = (stellra,stelldec)
+        return self._stellarium
     
     @classmethod
     def fromNexstar(cls,response):
@@ -68,18 +278,13 @@ class RADec(tuple):
         "C0000000" is -90.
         """
 
-        if not len(response)>15:
-            raise ValueError("Invalid NexStar coordinate")
-        rahrs = 24*int(response[0:8],16)/0x100000000
-        decdeg = 360*RADec.unsigned_to_signed_int(int(response[9:17],16))/0x100000000
-        return cls((rahrs,decdeg))
+        return cls(decode_nexstar(response))
 
     def toNexstar(self):
         """Convert a RADec object to NexStar's data format."""
-        intra = int(0x100000000*self[0]/24)
-        intdec = RADec.signed_to_unsigned_int(int(0x100000000*self[1]/360))
-        msg = '%08X,%08X' % (intra,intdec)
-        return bytes(msg,'ascii')
+        if self._nexstar is None:
+            self.__dict__['_nexstar'] = encode_nexstar(self[0],self[1])
+        return self._nexstar
 
     @classmethod
     def fromMeade(cls,raresp,decresp):
@@ -89,24 +294,13 @@ class RADec(tuple):
         HH,DD,MM,SS are hours, degrees, minutes, seconds.
         """
 
-        if len(raresp)< 9:
-            rahrs=0
-            raise ValueError("Invalid Meade right ascension.")
-        rahrs = int(raresp[0:2]) + int(raresp[3:5])/60 + int(raresp[6:8])/3600
-        if len(decresp) < 10:
-            decdeg=0
-            raise ValueError("Invalid Meade declination.")
-        if decresp[0:1] == b'+':   # Positive declination
-            decdeg = int(decresp[1:3]) + int(decresp[4:6])/60. + int(decresp[7:9])/3600.
-        else:                     # Negative
-            decdeg = -int(decresp[1:3]) - int(decresp[4:6])/60. - int(decresp[7:9])/3600.
-        return cls((rahrs,decdeg))
+        return cls((decode_meade_ra(raresp),decode_meade_dec(decresp)))
 
     def toMeade(self):
         """Convert a RADec object to Meade's data format."""
-        msgra = '%02d:%02d:%02d#' % self.ra_hms();
-        msgdec = '%+03d*%02d\'%02d#' % self.dec_dms();
-        return (msgra.encode('ascii'), msgdec.encode('ascii'))
+        if self._meade is None:
+            self.__dict__['_meade'] = (encode_meade_ra(self[0]), encode_meade_dec(self[1]))
+        return self._meade
 
     @classmethod
     def fromStr(cls,rastr,decstr):
@@ -159,8 +353,192 @@ class RADec(tuple):
 
     def rastr(self):
         """Right ascension as a formatted string."""
-        return "%dh%dm%ds" % self.ra_hms() 
+        if self._rastr is None:
+            self.__dict__['_rastr'] = "%dh%dm%ds" % self.ra_hms()
+        return self._rastr
 
     def decstr(self):
         """Declination as a formatted string."""
-        return "%dd%dm%ds" % self.dec_dms() 
+        if self._decstr is None:
+            self.__dict__['_decstr'] = "%dd%dm%ds" % self.dec_dms()
+        return self._decstr
+
+
+class RADecArray:
+
+    """Many RA/dec coordinates in NumPy arrays, for converting night-long logs
+    or target lists in one call instead of one RADec at a time.  Conversions
+    match the RADec methods of the same name, position by position.
+
+    Internal storage format: an (n,2) float64 array:
+    self.data[:,0]: decimal hours of right ascension
+    self.data[:,1]: decimal degrees of declination"""
+
+    _HEXDIGITS = b'0123456789ABCDEF'
+
+    def __init__(self,data=()):
+        if numpy is None:
+            raise ImportError("RADecArray requires numpy.")
+        self.data = numpy.array(data,dtype=numpy.float64).reshape(-1,2)
+
+    # ASCII byte -> hex digit value, -1 if not a hex digit
+    _HEXVALUES = [int(chr(c),16) if chr(c) in '0123456789abcdefABCDEF' else -1
+                  for c in range(256)]
+
+    @classmethod
+    def _array(cls,data):
+        """Byte responses as an (n,width) uint8 array.  Accepts a sequence of
+        bytes objects or a NumPy bytes ('S') array."""
+        data = numpy.asarray(data)
+        if data.dtype.kind != 'S':
+            data = data.astype('S')
+        data = data.reshape(-1)
+        return data.view(numpy.uint8).reshape(len(data),data.dtype.itemsize)
+
+    @classmethod
+    def fromRADecs(cls,positions):
+        """Create a RADecArray from a sequence of RADec objects."""
+        return cls([tuple(pos) for pos in positions])
+
+    def toRADecs(self):
+        """Convert to a list of RADec objects."""
+        return [RADec(pos) for pos in self.data.tolist()]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self,index):
+        """An integer index gives a RADec object; a slice or mask gives a RADecArray."""
+        if isinstance(index,(int,numpy.integer)):
+            return RADec(self.data[index].tolist())
+        return RADecArray(self.data[index])
+
+    def __iter__(self):
+        return iter(self.toRADecs())
+
+    def __repr__(self):
+        return 'RADecArray(%r)' % self.data
+
+    def valid(self):
+        """Boolean array: is RA between 0 and 24, and dec between -90 and 90?"""
+        ra = self.data[:,0]
+        dec = self.data[:,1]
+        return (ra >= 0) & (ra <= 24) & (dec >= -90) & (dec <= 90)
+
+    def ra(self):
+        """Right ascension in decimal hours."""
+        return self.data[:,0]
+    def dec(self):
+        """Declination in decimal degrees."""
+        return self.data[:,1]
+
+    @classmethod
+    def fromStellarium(cls,stellra,stelldec):
+        """Create a RADecArray from arrays in Stellarium's data format.
+        See RADec.fromStellarium()."""
+        stellra = numpy.asarray(stellra,dtype=numpy.float64)
+        stelldec = numpy.asarray(stelldec,dtype=numpy.float64)
+        return cls(numpy.column_stack((24*stellra/0x100000000, 90*stelldec/0x40000000)))
+
+    def toStellarium(self):
+        """Convert to Stellarium's data format: a (ra,dec) pair of uint32 and
+        int32 arrays.  See RADec.toStellarium()."""
+        stellra = (0x100000000*self.data[:,0]/24).astype(numpy.int64)
+        stelldec = (0x40000000*self.data[:,1]/90).astype(numpy.int64)
+        return (stellra.astype(numpy.uint32), stelldec.astype(numpy.int32))
+
+    @classmethod
+    def fromNexstar(cls,responses):
+        """Create a RADecArray from a sequence of NexStar responses,
+        b'RRRRRRRR,DDDDDDDD' with or without the trailing '#'.  See
+        RADec.fromNexstar()."""
+        raw = cls._array(responses)
+        if raw.shape[1] < 17:
+            raise ValueError("Invalid NexStar coordinate")
+        table = numpy.array(cls._HEXVALUES,dtype=numpy.int64)
+        digits = table[raw[:,:17]]
+        digits[:,8] = 0          # the comma
+        if (digits < 0).any() or (raw[:,8] != ord(',')).any():
+            raise ValueError("Invalid NexStar coordinate")
+        weights = numpy.int64(16)**numpy.arange(7,-1,-1,dtype=numpy.int64)
+        intra = digits[:,0:8] @ weights
+        intdec = digits[:,9:17] @ weights
+        intdec = numpy.where(intdec > 0x7FFFFFFF, intdec-0x100000000, intdec)
+        return cls(numpy.column_stack((24*intra/0x100000000, 360*intdec/0x100000000)))
+
+    def toNexstar(self):
+        """Convert to NexStar's data format: a NumPy array of 17-byte
+        b'RRRRRRRR,DDDDDDDD' strings.  See RADec.toNexstar()."""
+        intra = (0x100000000*self.data[:,0]/24).astype(numpy.int64)
+        intdec = (0x100000000*self.data[:,1]/360).astype(numpy.int64) & 0xFFFFFFFF
+        shifts = numpy.arange(28,-1,-4,dtype=numpy.int64)
+        hexdigits = numpy.frombuffer(self._HEXDIGITS,dtype=numpy.uint8)
+        out = numpy.empty((len(self.data),17),dtype=numpy.uint8)
+        out[:,0:8] = hexdigits[(intra[:,None] >> shifts) & 0xF]
+        out[:,8] = ord(',')
+        out[:,9:17] = hexdigits[(intdec[:,None] >> shifts) & 0xF]
+        return out.reshape(-1).view('S17')
+
+    @classmethod
+    def fromMeade(cls,raresps,decresps):
+        """Create a RADecArray from sequences of Meade responses,
+        b'HH:MM:SS#' and b'sDD*MM'SS#'.  See RADec.fromMeade()."""
+        ra = cls._array(raresps)
+        if ra.shape[1] < 8:   # The trailing '#' isn't needed
+            raise ValueError("Invalid Meade right ascension.")
+        dec = cls._array(decresps)
+        if dec.shape[1] < 9:
+            raise ValueError("Invalid Meade declination.")
+        radigits = ra[:,[0,1,3,4,6,7]].astype(numpy.int64) - ord('0')
+        if ((radigits < 0) | (radigits > 9)).any() or (ra[:,[2,5]] != ord(':')).any():
+            raise ValueError("Invalid Meade right ascension.")
+        decdigits = dec[:,[1,2,4,5,7,8]].astype(numpy.int64) - ord('0')
+        if ((decdigits < 0) | (decdigits > 9)).any():
+            raise ValueError("Invalid Meade declination.")
+        rahrs = (radigits[:,0]*10+radigits[:,1]) + (radigits[:,2]*10+radigits[:,3])/60 \
+                + (radigits[:,4]*10+radigits[:,5])/3600
+        decdeg = (decdigits[:,0]*10+decdigits[:,1]) + (decdigits[:,2]*10+decdigits[:,3])/60. \
+                 + (decdigits[:,4]*10+decdigits[:,5])/3600.
+        decdeg = numpy.where(dec[:,0] == ord('+'), decdeg, -decdeg)
+        return cls(numpy.column_stack((rahrs,decdeg)))
+
+    def toMeade(self):
+        """Convert to Meade's data format: a (ra,dec) pair of NumPy arrays of
+        b'HH:MM:SS#' and b'sDD*MM'SS#' strings.  See RADec.toMeade()."""
+        rahours,ramin,rasec = self.ra_hms()
+        decldeg,declmin,declsec = self.dec_dms()
+        n = len(self.data)
+
+        ra = numpy.empty((n,9),dtype=numpy.uint8)
+        ra[:,[2,5]] = ord(':')
+        ra[:,8] = ord('#')
+        for col,value in ((0,rahours),(3,ramin),(6,rasec.astype(numpy.int64))):
+            ra[:,col] = ord('0') + value//10 % 10
+            ra[:,col+1] = ord('0') + value % 10
+
+        dec = numpy.empty((n,10),dtype=numpy.uint8)
+        dec[:,0] = numpy.where(self.data[:,1] < 0, ord('-'), ord('+'))     # not decldeg: -0.5 truncates to 0
+        dec[:,3] = ord('*')
+        dec[:,6] = ord("'")
+        dec[:,9] = ord('#')
+        for col,value in ((1,numpy.abs(decldeg)),(4,declmin),(7,declsec.astype(numpy.int64))):
+            dec[:,col] = ord('0') + value//10 % 10
+            dec[:,col+1] = ord('0') + value % 10
+        return (ra.reshape(-1).view('S9'), dec.reshape(-1).view('S10'))
+
+    def ra_hms(self):
+        """Right ascension as (hour, minute, second) arrays.  See RADec.ra_hms()."""
+        rahours = self.data[:,0].astype(numpy.int64)
+        ra_decimal_mins = (self.data[:,0] - rahours)*60
+        ramin = ra_decimal_mins.astype(numpy.int64)
+        rasec = (ra_decimal_mins-ramin)*60
+        return (rahours, ramin, rasec)
+
+    def dec_dms(self):
+        """Declination as (degree, minute, second) arrays.  For negative
+        declinations, the sign is carried only in the degrees.  See RADec.dec_dms()."""
+        decldeg = self.data[:,1].astype(numpy.int64)
+        declination_decimal_mins = numpy.abs((self.data[:,1] - decldeg)*60)
+        declmin = declination_decimal_mins.astype(numpy.int64)
+        declsec = (declination_decimal_mins-declmin)*60
+        return (decldeg, declmin, declsec)
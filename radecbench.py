@@ -0,0 +1,152 @@
+""" Micro-benchmarks for the coordinate codecs in radec.py.
+
+Times the radec codec functions against the RADec classmethods and against
+the original slice-and-int() implementations, on large synthetic inputs.
+Run from the command line:
+
+    python radecbench.py [count]
+"""
+
+import random
+import sys
+import time
+
+import radec
+
+def legacy_fromNexstar(response):
+    """The original RADec.fromNexstar() parser, for comparison."""
+    if not len(response)>15:
+        raise ValueError("Invalid NexStar coordinate")
+    rahrs = 24*int(response[0:8],16)/0x100000000
+    decdeg = 360*radec.RADec.unsigned_to_signed_int(int(response[9:17],16))/0x100000000
+    return (rahrs,decdeg)
+
+def legacy_toNexstar(pos):
+    """The original RADec.toNexstar() formatter, for comparison."""
+    intra = int(0x100000000*pos[0]/24)
+    intdec = radec.RADec.signed_to_unsigned_int(int(0x100000000*pos[1]/360))
+    msg = '%08X,%08X' % (intra,intdec)
+    return bytes(msg,'ascii')
+
+def legacy_fromMeade(raresp,decresp):
+    """The original RADec.fromMeade() parser, for comparison."""
+    if len(raresp)< 9:
+        raise ValueError("Invalid Meade right ascension.")
+    rahrs = int(raresp[0:2]) + int(raresp[3:5])/60 + int(raresp[6:8])/3600
+    if len(decresp) < 10:
+        raise ValueError("Invalid Meade declination.")
+    if decresp[0:1] == b'+':   # Positive declination
+        decdeg = int(decresp[1:3]) + int(decresp[4:6])/60. + int(decresp[7:9])/3600.
+    else:                     # Negative
+        decdeg = -int(decresp[1:3]) - int(decresp[4:6])/60. - int(decresp[7:9])/3600.
+    return (rahrs,decdeg)
+
+def legacy_toMeade(pos):
+    """The original RADec.toMeade() formatter, for comparison."""
+    rahours = int(pos[0])
+    ra_decimal_mins = (pos[0] - rahours)*60
+    ramin = int(ra_decimal_mins)
+    decldeg = int(pos[1])
+    declination_decimal_mins = abs((pos[1] - decldeg)*60)
+    declmin = int(declination_decimal_mins)
+    msgra = '%02d:%02d:%02d#' % (rahours,ramin,(ra_decimal_mins-ramin)*60)
+    msgdec = '%+03d*%02d\'%02d#' % (decldeg,declmin,(declination_decimal_mins-declmin)*60)
+    return (msgra.encode('ascii'), msgdec.encode('ascii'))
+
+def synthetic(count,seed=1):
+    """count random (ra,dec) positions and their NexStar and Meade encodings."""
+    rng = random.Random(seed)
+    positions = [(rng.uniform(0,24),rng.uniform(-90,90)) for i in range(count)]
+    nexstar = [legacy_toNexstar(pos)+b'#' for pos in positions]
+    meade = [legacy_toMeade(pos) for pos in positions]
+    return positions,nexstar,meade
+
+def timeit(name,func,count,repeat=5):
+    """Run func() repeat times, and print the best time per item."""
+    elapsed = float('inf')
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = min(elapsed,time.perf_counter()-start)
+    print('%-40s %8.0f ns/item  %8.3f s total' % (name,elapsed*1e9/count,elapsed))
+    return elapsed
+
+def run(count=200000):
+    positions,nexstar,meade = synthetic(count)
+    raresps = [ra for ra,dec in meade]
+    decresps = [dec for ra,dec in meade]
+
+    # Make sure everything being timed gives the same answers.
+    for pos,ns,(ra,dec) in zip(positions[:1000],nexstar,meade):
+        assert radec.decode_nexstar(ns) == legacy_fromNexstar(ns)
+        assert radec.encode_nexstar(*pos) == legacy_toNexstar(pos)
+        assert (radec.decode_meade_ra(ra),radec.decode_meade_dec(dec)) == legacy_fromMeade(ra,dec)
+        if not -1 < pos[1] < 0:        # where legacy_toMeade() drops the minus sign
+            assert (radec.encode_meade_ra(pos[0]),radec.encode_meade_dec(pos[1])) == legacy_toMeade(pos)
+
+    print('%d synthetic positions' % count)
+    print('\nNexStar parse')
+    timeit('legacy slice + int(,16)',lambda: [legacy_fromNexstar(r) for r in nexstar],count)
+    timeit('radec.decode_nexstar',lambda: [radec.decode_nexstar(r) for r in nexstar],count)
+    timeit('RADec.fromNexstar',lambda: [radec.RADec.fromNexstar(r) for r in nexstar],count)
+    stream = b''.join(nexstar)
+    step = len(nexstar[0])
+    timeit('radec.decode_nexstar, one buffer',
+           lambda: [radec.decode_nexstar(stream,i) for i in range(0,len(stream),step)],count)
+
+    print('\nNexStar format')
+    timeit('legacy %08X + bytes()',lambda: [legacy_toNexstar(p) for p in positions],count)
+    timeit('radec.encode_nexstar',lambda: [radec.encode_nexstar(ra,dec) for ra,dec in positions],count)
+    buf = bytearray(radec.NEXSTAR_LENGTH*count)
+    def copy():
+        offset = 0
+        for ra,dec in positions:
+            buf[offset:offset+radec.NEXSTAR_LENGTH] = radec.encode_nexstar(ra,dec)
+            offset += radec.NEXSTAR_LENGTH
+    timeit('radec.encode_nexstar + copy',copy,count)
+    def into():
+        offset = 0
+        for ra,dec in positions:
+            offset = radec.encode_nexstar_into(buf,offset,ra,dec)
+    timeit('radec.encode_nexstar_into',into,count)
+    timeit('RADec(...).toNexstar, new objects',lambda: [radec.RADec(p).toNexstar() for p in positions],count)
+    radec.interned = radec.InternCache()
+    timeit('RADec(...).toNexstar, interned',lambda: [radec.RADec(p).toNexstar() for p in positions],count)
+    radec.interned = None
+
+    print('\nMeade parse')
+    timeit('legacy slice + int()',lambda: [legacy_fromMeade(ra,dec) for ra,dec in meade],count)
+    timeit('radec.decode_meade_ra/dec',
+           lambda: [(radec.decode_meade_ra(ra),radec.decode_meade_dec(dec)) for ra,dec in meade],count)
+    timeit('RADec.fromMeade',lambda: [radec.RADec.fromMeade(ra,dec) for ra,dec in meade],count)
+
+    print('\nMeade format')
+    timeit('legacy % formatting + encode()',lambda: [legacy_toMeade(p) for p in positions],count)
+    timeit('radec.encode_meade_ra/dec',
+           lambda: [(radec.encode_meade_ra(ra),radec.encode_meade_dec(dec)) for ra,dec in positions],count)
+    buf = bytearray((radec.MEADE_RA_LENGTH+radec.MEADE_DEC_LENGTH)*count)
+    def copy():
+        offset = 0
+        for ra,dec in positions:
+            buf[offset:offset+radec.MEADE_RA_LENGTH] = radec.encode_meade_ra(ra)
+            offset += radec.MEADE_RA_LENGTH
+            buf[offset:offset+radec.MEADE_DEC_LENGTH] = radec.encode_meade_dec(dec)
+            offset += radec.MEADE_DEC_LENGTH
+    timeit('radec.encode_meade_ra/dec + copy',copy,count)
+    def into():
+        offset = 0
+        for ra,dec in positions:
+            offset = radec.encode_meade_ra_into(buf,offset,ra)
+            offset = radec.encode_meade_dec_into(buf,offset,dec)
+    timeit('radec.encode_meade_*_into',into,count)
+
+    if radec.numpy is not None:
+        print('\nRADecArray (vectorized)')
+        timeit('RADecArray.fromNexstar',lambda: radec.RADecArray.fromNexstar(nexstar),count)
+        array = radec.RADecArray(positions)
+        timeit('RADecArray.toNexstar',array.toNexstar,count)
+        timeit('RADecArray.fromMeade',lambda: radec.RADecArray.fromMeade(raresps,decresps),count)
+        timeit('RADecArray.toMeade',array.toMeade,count)
+
+if __name__ == '__main__':
+    run(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,93 @@
+""" RateEstimator: how fast the telescope is moving, from positions already
+collected by polling, without the five-second wait of the drivers' old
+getrate().
+
+Keeps the most recent positions in a fixed-size ring buffer, and fits a
+straight line to each axis by least squares over a time window.  Rates are in
+the units getrate() has always used: RA in seconds of time per second, dec in
+arcseconds per second.  RA is unwrapped through 0h/24h before fitting."""
+
+import math
+import threading
+import time
+
+def ra_difference(ra1,ra0):
+    """ra1-ra0 in hours, taking the short way around through 0h/24h."""
+    return (ra1-ra0+12) % 24 - 12
+
+class RateEstimator:
+    """Least-squares motion rate over the last window seconds of up to size
+    positions."""
+
+    def __init__(self,size=64,window=10.0,clock=time.monotonic):
+        self.size = size
+        self.window = window
+        self.clock = clock
+        self.times = [0.0]*size
+        self.ras = [0.0]*size
+        self.decs = [0.0]*size
+        self.count = 0          # samples stored, up to size
+        self.next = 0           # ring buffer slot for the next sample
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+            self.next = 0
+
+    def add(self,pos,when=None):
+        """Record RADec pos (or any (ra,dec) pair), measured at time when (default:
+        now).  None is ignored, so a failed poll can be passed straight in."""
+        if pos is None:
+            return
+        if when is None:
+            when = self.clock()
+        with self.lock:
+            i = self.next
+            self.times[i] = when
+            self.ras[i] = pos[0]
+            self.decs[i] = pos[1]
+            self.next = (i+1) % self.size
+            self.count = min(self.count+1,self.size)
+
+    def _recent(self,window):
+        """Samples in the last window seconds, as (dt, dra, ddec) relative to the
+        newest, with RA unwrapped."""
+        with self.lock:
+            newest = (self.next-1) % self.size
+            t0,ra0,dec0 = self.times[newest],self.ras[newest],self.decs[newest]
+            samples = []
+            for k in range(self.count):
+                i = (newest-k) % self.size
+                dt = self.times[i]-t0
+                if dt < -window:
+                    break
+                samples.append((dt,ra_difference(self.ras[i],ra0),self.decs[i]-dec0))
+        return samples,dec0
+
+    def rate(self,window=None):
+        """(RA rate, dec rate, residual) over the last window seconds (default: the
+        estimator's window), or None if there are fewer than two samples in it.
+        residual is the RMS scatter of the samples about the fitted motion, in
+        arcseconds on the sky."""
+        if window is None:
+            window = self.window
+        samples,dec0 = self._recent(window)
+        n = len(samples)
+        if n < 2:
+            return None
+        tmean = sum(s[0] for s in samples)/n
+        ramean = sum(s[1] for s in samples)/n
+        decmean = sum(s[2] for s in samples)/n
+        stt = sum((s[0]-tmean)**2 for s in samples)
+        if stt <= 0:
+            return None
+        rarate = sum((s[0]-tmean)*(s[1]-ramean) for s in samples)/stt
+        decrate = sum((s[0]-tmean)*(s[2]-decmean) for s in samples)/stt
+        rascale = 15*3600*math.cos(math.radians(dec0))   # hours of RA -> arcsec on sky
+        sumsq = 0.0
+        for dt,dra,ddec in samples:
+            rares = (dra - ramean - rarate*(dt-tmean))*rascale
+            decres = (ddec - decmean - decrate*(dt-tmean))*3600
+            sumsq += rares*rares + decres*decres
+        return (rarate*3600, decrate*3600, math.sqrt(sumsq/n))
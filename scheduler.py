@@ -0,0 +1,91 @@
+""" MotionScheduler: runs scope commands at precise times, for timed slews and
+focuser moves.
+
+Tk's after() and button-release events can be tens of milliseconds late, so
+a move ended from the GUI lasts as long as the GUI is slow.  The scheduler
+has its own thread working from the monotonic clock: it sleeps until just
+before a job is due, then spins for the last couple of milliseconds, so jobs
+typically run within a millisecond of their time."""
+
+import heapq
+import itertools
+import threading
+import time
+
+class Job:
+    """A scheduled call.  done is set once it has run (or been cancelled);
+    late is how many seconds after its time it actually ran."""
+
+    def __init__(self,when,func,args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.done = threading.Event()
+        self.cancelled = False
+        self.late = None
+
+    def cancel(self):
+        """Don't run this job, if it hasn't run yet."""
+        self.cancelled = True
+        self.done.set()
+
+    def wait(self,timeout=None):
+        """Wait for the job to run.  Returns False on timeout."""
+        return self.done.wait(timeout)
+
+class MotionScheduler(threading.Thread):
+
+    SPIN = 0.002        # Busy-wait this many seconds before a job is due
+
+    def __init__(self):
+        threading.Thread.__init__(self,name='MotionScheduler',daemon=True)
+        self.jobs = []                      # heap of (when, sequence, Job)
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.running = True
+        self.start()
+
+    def at(self,when,func,*args):
+        """Run func(*args) at time.monotonic() time when.  Returns a Job."""
+        job = Job(when,func,args)
+        with self.condition:
+            heapq.heappush(self.jobs,(when,next(self.sequence),job))
+            self.condition.notify()
+        return job
+
+    def after(self,delay,func,*args):
+        """Run func(*args) delay seconds from now.  Returns a Job."""
+        return self.at(time.monotonic()+delay,func,*args)
+
+    def shutdown(self):
+        """Stop the scheduler thread.  Jobs not yet run are cancelled."""
+        with self.condition:
+            self.running = False
+            for when,sequence,job in self.jobs:
+                job.cancel()
+            self.jobs = []
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.jobs:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                when,sequence,job = self.jobs[0]
+                remaining = when-time.monotonic()
+                if remaining > self.SPIN:
+                    self.condition.wait(remaining-self.SPIN)   # a new, earlier job may wake us
+                    continue
+                heapq.heappop(self.jobs)
+            while time.monotonic() < when:
+                pass
+            if job.cancelled:
+                continue
+            job.late = time.monotonic()-when
+            try:
+                job.func(*job.args)
+            except Exception as e:
+                print('Scheduled command failed:',e)
+            job.done.set()
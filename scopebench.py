@@ -0,0 +1,260 @@
+""" End-to-end benchmarks for the control loop: the drivers, the UI's poll
+cycle and the Stellarium server, run headless against emulated scopes (see
+emulator.py) and fake Stellarium clients.
+
+Measures, for each protocol:
+
+    command round trips     getposition() and is_safe() latency percentiles
+    motion latency          sleweast() call to the emulated mount moving
+    poll throughput         ScopeManagerUI.poll() cycles/second, run flat out
+    Stellarium GOTO         GOTO message sent by a client to the mount slewing
+    Stellarium fan-out      position reports/second reaching the clients
+    resources               CPU seconds used and peak memory
+    serial commands         per-command statistics (see stats.py)
+
+Run from the command line:
+
+    python scopebench.py [--protocol nexstar|meade|both] [--baudrate 9600]
+                         [--latency 0.0] [--clients 4] [--duration 5]
+                         [--samples 200] [--output results.json]
+
+Results are printed, and with --output saved as JSON for comparing runs."""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+
+import emulator
+import meade
+import nexstar
+import positioncache
+import radec
+import scopemanagerui
+import stats
+import stellariumserver
+
+def percentiles(samples):
+    """Summary of latencies samples (seconds) in milliseconds."""
+    if not samples:
+        return None
+    s = sorted(samples)
+    pick = lambda p: s[min(int(p*len(s)),len(s)-1)]*1000
+    return dict(count=len(s),mean=sum(s)/len(s)*1000,p50=pick(0.5),p90=pick(0.9),
+                p99=pick(0.99),max=s[-1]*1000)
+
+def waitfor(condition,timeout=5.0):
+    """Spin until condition() is true.  Returns the time it took, or None."""
+    start = time.perf_counter()
+    while time.perf_counter()-start < timeout:
+        if condition():
+            return time.perf_counter()-start
+    return None
+
+class Harness:
+    """Stands in for the Tk window, so the UI's own poll() can run headless."""
+
+    class Log:
+        def log(self,text):
+            pass
+
+    class Text:
+        def set(self,text):
+            pass
+
+    def __init__(self,scope,stellarium):
+        self.scope = scope
+        self.position = positioncache.PositionCache(scope)
+        self.stellarium = stellarium
+        self.messages = self.Log()
+        self.positiontext = self.Text()
+        self.sync_confirm = 0
+
+    def after(self,ms,func):
+        pass        # the benchmark calls poll() itself
+
+    def checkports(self):
+        pass        # no hotplugging here
+
+    def poll(self):
+        scopemanagerui.ScopeManagerUI.poll(self)
+
+class StellariumClient(threading.Thread):
+    """A fake Stellarium, connected to the GOTO port at address, counting the
+    position reports it receives."""
+
+    def __init__(self,address):
+        threading.Thread.__init__(self,daemon=True)
+        self.sock = socket.create_connection(address)
+        self.reports = 0
+        self.running = True
+        self.start()
+
+    def run(self):
+        buf = b''
+        while self.running:
+            try:
+                data = self.sock.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buf += data
+            while len(buf) >= 2 and len(buf) >= struct.unpack_from('<H',buf)[0]:
+                size = struct.unpack_from('<H',buf)[0]
+                buf = buf[size:]
+                self.reports += 1
+
+    def goto(self,pos):
+        ra,dec = pos.toStellarium()
+        self.sock.sendall(struct.pack('<HHQIi',20,0,int(time.time()*1e6),ra,dec))
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+def quiet():
+    """Swallow the drivers' chatter while timing them."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+def benchmark(protocol,baudrate=9600,latency=0.0,clients=4,duration=5.0,samples=200):
+    """Run every benchmark for protocol 'nexstar' or 'meade'.  Returns a dict of
+    results."""
+    results = dict(protocol=protocol)
+    mount = emulator.Mount(ra=3.0,dec=40.0)
+    if protocol == 'nexstar':
+        scope = emulator.NexStarEmulator(mount,baudrate=baudrate,latency=latency)
+        with quiet():
+            telescope = nexstar.NexStar(scope.port)
+    else:
+        scope = emulator.MeadeEmulator(mount,baudrate=baudrate,latency=latency)
+        with quiet():
+            telescope = meade.Meade(scope.port)
+    if not telescope.ready:
+        scope.close()
+        raise RuntimeError('Driver could not open the emulated %s scope.' % protocol)
+    stellarium = stellariumserver.StellariumServer(gotoport=0,syncport=0,log=lambda message: None)
+    gotoaddress,syncaddress = stellarium.addresses()
+    fakes = []
+    stats.recorder.reset()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with quiet():
+            # Command round trips
+            times = []
+            for i in range(samples):
+                start = time.perf_counter()
+                telescope.getposition()
+                times.append(time.perf_counter()-start)
+            results['getposition'] = percentiles(times)
+            times = []
+            for i in range(samples):
+                start = time.perf_counter()
+                telescope.is_safe(refresh=True)
+                times.append(time.perf_counter()-start)
+            results['is_safe'] = percentiles(times)
+
+            # Button press to motion
+            times = []
+            for i in range(min(samples,20)):
+                start = time.perf_counter()
+                telescope.sleweast(5)
+                waitfor(lambda: mount.rates[0] != 0)
+                times.append(time.perf_counter()-start)
+                telescope.stop()
+                waitfor(lambda: mount.rates[0] == 0)
+            results['motion'] = percentiles(times)
+
+            # Stellarium clients connect
+            harness = Harness(telescope,stellarium)
+            for i in range(clients):
+                fakes.append(StellariumClient(gotoaddress))
+                stellarium.receive()        # accept it, before the listen backlog fills
+            deadline = time.perf_counter()+5.0
+            while len(stellarium.clients()) < clients and time.perf_counter() < deadline:
+                stellarium.receive()
+
+            # Poll throughput and fan-out
+            for fake in fakes:
+                fake.reports = 0
+            times = []
+            start = time.perf_counter()
+            while time.perf_counter()-start < duration:
+                t = time.perf_counter()
+                harness.poll()
+                times.append(time.perf_counter()-t)
+            elapsed = time.perf_counter()-start
+            time.sleep(0.1)     # let the last reports arrive
+            results['poll'] = percentiles(times)
+            results['polls_per_second'] = len(times)/elapsed
+            reports = sum(fake.reports for fake in fakes)
+            results['clients'] = clients
+            results['reports_per_second'] = reports/elapsed
+            results['reports_per_client_per_second'] = reports/elapsed/clients if clients else 0.0
+
+            # Stellarium GOTO to mount slewing
+            times = []
+            if fakes:
+                for i in range(min(samples,10)):
+                    telescope.stop()
+                    mount.stop()
+                    target = radec.RADec(((3.5+i*0.1) % 24,45.0))
+                    start = time.perf_counter()
+                    fakes[0].goto(target)
+                    while mount.target is None and time.perf_counter()-start < 5.0:
+                        harness.poll()
+                    times.append(time.perf_counter()-start)
+                telescope.stop()
+            results['stellarium_goto'] = percentiles(times)
+    finally:
+        end = resource.getrusage(resource.RUSAGE_SELF)
+        results['cpu_seconds'] = (end.ru_utime-usage.ru_utime)+(end.ru_stime-usage.ru_stime)
+        results['max_rss_kb'] = end.ru_maxrss
+        results['commands'] = stats.recorder.snapshot()
+        for fake in fakes:
+            fake.close()
+        stellarium.close()
+        telescope.close()
+        scope.close()
+    return results
+
+def report(results):
+    print('%s:' % results['protocol'])
+    for key in ('getposition','is_safe','motion','poll','stellarium_goto'):
+        p = results.get(key)
+        if p:
+            print('  %-16s mean %7.2f  p50 %7.2f  p90 %7.2f  p99 %7.2f  max %7.2f ms  (%d)' %
+                  (key,p['mean'],p['p50'],p['p90'],p['p99'],p['max'],p['count']))
+    print('  %.1f polls/second; %.1f Stellarium reports/second to %d clients' %
+          (results['polls_per_second'],results['reports_per_second'],results['clients']))
+    print('  %.2f CPU seconds; peak memory %d kB' % (results['cpu_seconds'],results['max_rss_kb']))
+    print('  ' + stats.recorder.report().replace('\n','\n  '))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the telescope control loop.')
+    parser.add_argument('--protocol',choices=('nexstar','meade','both'),default='both')
+    parser.add_argument('--baudrate',type=int,default=9600)
+    parser.add_argument('--latency',type=float,default=0.0,help='emulated scope reply latency, seconds')
+    parser.add_argument('--clients',type=int,default=4,help='fake Stellarium clients')
+    parser.add_argument('--duration',type=float,default=5.0,help='seconds of flat-out polling')
+    parser.add_argument('--samples',type=int,default=200,help='round trips timed per command')
+    parser.add_argument('--output',help='save results to this JSON file')
+    args = parser.parse_args()
+    protocols = ('nexstar','meade') if args.protocol == 'both' else (args.protocol,)
+    runs = []
+    for protocol in protocols:
+        results = benchmark(protocol,args.baudrate,args.latency,args.clients,args.duration,args.samples)
+        report(results)
+        runs.append(results)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump(dict(time=time.time(),python=sys.version,platform=platform.platform(),
+                           settings=vars(args),runs=runs),f,indent=1)
+        print('Results saved to',args.output)
@@ -4,13 +4,21 @@ Tkinter user interface for Scope Manager.
 
 """
 import stellariumserver
+import syncguard
 import meade
 import nexstar
 import radec
+import positioncache
 import time
 import serialist
+import discovery
 import log
 import inspect
+import os
+import queue
+import serialdev
+import serialtrace
+import threading
 
 try:
     # for Python2
@@ -127,14 +135,19 @@ class NexStarPanel(Frame):
 class ScopeManagerUI(Frame):
     def __init__(self, master=None):
         """Create UI, create scope and stellarium
-        communication objects, and start polling."""
+        communication objects, and start polling.  If the SCOPETRACE
+        environment variable names a file, serial traffic is traced to it
+        (see serialtrace.py)."""
         Frame.__init__(self,master)
+        if os.environ.get('SCOPETRACE'):
+            serialdev.tracer = serialtrace.TraceFile(os.environ['SCOPETRACE'])
         self.grid()
         self.scope = None
+        self.position = None
         self.createWidgets()
-        self.stellarium = stellariumserver.StellariumServer()
+        self.stellarium = stellariumserver.StellariumServer(log=self.messages.log)
+        self.syncguard = syncguard.SyncGuard()
         self.poll()
-        self.sync_confirm = time.clock()
         self.master.protocol("WM_DELETE_WINDOW", self.quit)
         self.update()
         
@@ -144,6 +157,8 @@ class ScopeManagerUI(Frame):
         """Call this poller again in 1 second."""
         self.after(1000, self.poll)
 
+        self.checkports()
+
         """Listen for commands from Stellarium, send them on to scope."""        
         gotopos,syncpos = self.stellarium.receive()
         if gotopos is not None:
@@ -154,20 +169,16 @@ class ScopeManagerUI(Frame):
         if syncpos is not None:
             self.messages.log('Stellarium commands SYNC '+str(syncpos.ra())+' '+str(syncpos.dec()))
             if self.scope is not None and self.scope.ready:
-                if syncpos.dec() < 0:
-                    self.messages.log("Can't sync to southern hemisphere.  Blame Celestron.")
-                else:
-                    if (time.clock() - self.sync_confirm > 10):
-                        self.messages.log("Confirm SYNC: make sure telescope is centered on Stellarium's target, and SYNC again.")
-                        self.sync_confirm = time.clock()
-                    else:
-                        self.scope.sync(syncpos)
-                        self.stellarium.send(syncpos,type='SYNC')
-                        self.sync_confirm = time.clock() - 20
+                sync,message = self.syncguard.check(self.scope,syncpos)
+                if message is not None:
+                    self.messages.log(message)
+                if sync:
+                    self.scope.sync(syncpos)
+                    self.stellarium.send(syncpos,type='SYNC')
 
         """Get scope's current position, and report it to Stellarium and in this window."""        
         if self.scope is not None and self.scope.ready:
-            scopepos = self.scope.getposition(dump=True)
+            scopepos = self.position.poll()
             if scopepos is not None:
                 self.stellarium.send(scopepos)
                 self.positiontext.set("RA: %s\nDec: %s" % (scopepos.rastr(),scopepos.decstr()))
@@ -176,7 +187,7 @@ class ScopeManagerUI(Frame):
         if self.scope is not None and self.scope.ready:
             self.messages.log('Putting scope into safe mode.')
             self.scope.set_safe(True)
-            if not self.scope.is_safe():
+            if not self.scope.is_safe(refresh=True):
                 self.messages.log('WARNING: Scope is still active!')
                 time.sleep(3)
             self.scope.close()
@@ -250,46 +261,107 @@ class ScopeManagerUI(Frame):
         self.messages.grid(column=1,row=8,columnspan=5)
 
         """serialist.Serialist() returns a list of active serial ports on this machine.
-        This list is not updated while Scope Manager is running."""
+        On Linux, a serialist.PortWatcher reports ports plugged in later (see
+        checkports()); elsewhere the list is not updated while Scope Manager is
+        running."""
         portList = serialist.Serialist()
+        self.probecache = discovery.ProbeCache()
+        self.probes = queue.Queue()     # (port, scope type, version) found by probeports()
+        try:
+            self.portwatcher = serialist.PortWatcher()
+        except OSError:         # not Linux
+            self.portwatcher = None
         self.scopePorts = [];        
         self.scopeTypes = [];
         self.port = StringVar()
         self.scopespecific = None;
-        for port in portList:
-            self.update()
-            self.messages.log('Scanning '+port+' for NexStar telescopes.')
-            scope = nexstar.NexStar(port)
-            if scope.ready:
-                self.messages.log('Found NexStar telescope on port '+port+'.')
-                self.scopePorts.append(port)
-                self.scopeTypes.append('NexStar')
-            else:
-                scope.close()
-                del scope
-                self.update()
-                self.messages.log('Scanning '+port+' for Meade telescopes.')
-                scope = meade.Meade(port)
-                if scope.ready:
-                    self.messages.log('Found Meade telescope on port '+port+'.')
-                    self.scopePorts.append(port)
-                    self.scopeTypes.append('Meade')
-            scope.close()
-            del scope
+        self.messages.log('Scanning '+', '.join(portList)+' for telescopes.')
+        self.update()
+        for port,(scopetype,version) in discovery.discover(portList,cache=self.probecache).items():
+            self.messages.log('Found '+scopetype+' telescope (firmware '+str(version)+') on port '+port+'.')
+            self.scopePorts.append(port)
+            self.scopeTypes.append(scopetype)
             
         if not self.scopePorts:
-            self.messages.log('No serial ports found.  Connect a serial device and restart Telescope Manager.\n')
+            if self.portwatcher is not None:
+                self.messages.log('No telescopes found.  Plug one in, and it will be found and connected.\n')
+            else:
+                self.messages.log('No telescopes found.  Connect a serial device and restart Telescope Manager.\n')
             portList = ['NONE FOUND']
         else:
             self.port.set(self.scopePorts[0])
             self.updateport()
-        self.portmenu = OptionMenu (self, self.port, *(self.scopePorts), command=self.updateport)
+        self.portmenu = OptionMenu (self, self.port, *(self.scopePorts or portList), command=self.updateport)
         self.portmenu.grid(column=2,row=0,columnspan=4,sticky=W)
 
         self.messages.insert(END,'Telescope Manager ready.\n')
 
+    def checkports(self):
+        """Drop ports that have been unplugged from the port menu, disconnecting
+        from the telescope if it was on one, and start looking for telescopes on
+        ports plugged in since the last check.  Probing takes seconds, so it
+        runs in probeports(), in another thread; telescopes it has found are
+        added to the menu here, and connected to if there isn't one connected
+        already."""
+        if self.portwatcher is None:
+            return
+        menu = self.portmenu['menu']
+        for added,removed in self.portwatcher.changes():
+            for port in removed:
+                if port in self.scopePorts:
+                    self.messages.log('Port '+port+' unplugged.')
+                    index = self.scopePorts.index(port)
+                    menu.delete(index)
+                    del self.scopePorts[index]
+                    del self.scopeTypes[index]
+                    if port == self.port.get() and self.scope is not None:
+                        self.disconnect()
+            if added:
+                self.messages.log('Scanning '+', '.join(added)+' for telescopes.')
+                threading.Thread(target=self.probeports,args=(added,),name='ProbePorts',daemon=True).start()
+        while True:
+            try:
+                port,scopetype,version = self.probes.get_nowait()
+            except queue.Empty:
+                break
+            if port not in self.portwatcher.ports or port in self.scopePorts:
+                continue        # unplugged again while being probed
+            self.messages.log('Found '+scopetype+' telescope (firmware '+str(version)+') on port '+port+'.')
+            if not self.scopePorts:
+                menu.delete(0,END)      # 'NONE FOUND'
+            self.scopePorts.append(port)
+            self.scopeTypes.append(scopetype)
+            menu.add_command(label=port,command=lambda port=port: self.selectport(port))
+            if self.scope is None or not self.scope.ready:
+                self.selectport(port)
+
+    def probeports(self,ports):
+        """Look for telescopes on ports, and queue what's found for checkports().
+        Runs in its own thread, so it mustn't touch the window."""
+        for port,(scopetype,version) in discovery.discover(ports,cache=self.probecache).items():
+            self.probes.put((port,scopetype,version))
+
+    def disconnect(self):
+        """The telescope's port has gone: close it, without trying to put the
+        scope in safe mode first."""
+        self.messages.log('Telescope disconnected.')
+        self.scope.close()
+        self.scope = None
+        self.position = None
+        if self.scopespecific is not None:
+            self.scopespecific.grid_remove()
+            self.scopespecific = None
+        self.positiontext.set('Not Connected')
+
+    def selectport(self,port):
+        self.port.set(port)
+        self.updateport()
+
     def undosync(self):
-        self.scope.undosync()
+        if self.scope is not None and self.scope.ready:
+            self.scope.undosync()
+        else:
+            self.messages.log('Not connected to a telescope.')
     
     def north(self, event=None):
         """Command scope to slew north.  Annoyingly, when the scope is pointed west
@@ -348,7 +420,7 @@ class ScopeManagerUI(Frame):
         if self.scope is not None and self.scope.ready:
             self.messages.log('Putting scope into safe mode.')
             self.scope.set_safe(True)  # Activate safe mode
-            if not self.scope.is_safe():
+            if not self.scope.is_safe(refresh=True):
                 self.messages.log('WARNING: Scope is still active!')
                 time.sleep(3)
             if self.scopespecific is not None:
@@ -362,6 +434,7 @@ class ScopeManagerUI(Frame):
         else:
             self.scope = meade.Meade(str(self.port.get()))
             self.scopespecific = MeadePanel(self)
+        self.position = positioncache.PositionCache(self.scope)
         if self.scope is not None and self.scope.ready:
             self.messages.log('Connected to '+newscopetype+' on '+str(self.port.get()))
             self.safemode.set(int(self.scope.is_safe()))
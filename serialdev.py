@@ -1,5 +1,152 @@
 """ Generic methods class for serial I/O."""
 
+import threading
+import time
+
+import serial
+
+import serialtrace
+import stats
+
+tracer = None       # a serialtrace.TraceFile every new SerialPort records its traffic in
+
+class RTTEstimator:
+    """Round trip time estimate for one serial port, for setting reply timeouts.
+    Works like TCP's retransmit timer (RFC 6298): a smoothed round trip time plus
+    four times its mean deviation, backing off when a reply times out."""
+
+    def __init__(self,initial=1.0,minimum=0.03,maximum=None):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = initial if maximum is None else maximum
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial
+
+    def update(self,sample):
+        """Fold in a measured round trip time, in seconds."""
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample/2
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt-sample)
+            self.srtt = 0.875*self.srtt + 0.125*sample
+        self.rto = min(max(self.srtt + 4*self.rttvar,self.minimum),self.maximum)
+
+    def backoff(self):
+        """A reply timed out: be more patient next time."""
+        self.rto = min(self.rto*2,self.maximum)
+
+    def timeout(self):
+        return self.rto
+
+class SerialPort:
+    """A pyserial port that reads replies up to their terminator, with timeouts
+    that adapt to how quickly this port has been answering.  Anything not
+    defined here (flush, in_waiting...) goes straight to the pyserial port.
+    transact() and write() hold the port's lock, so a command from another
+    thread can't land in the middle of an exchange."""
+
+    def __init__(self,comport,baudrate=9600,timeout=1):
+        self.ser = serial.Serial(comport,baudrate,timeout=timeout)
+        self.bytetime = 10.0/baudrate       # start + 8 data + stop bits
+        self.rtt = RTTEstimator(initial=timeout)
+        self.timeouts = 0
+        self.lock = threading.RLock()
+        self.stats = stats.recorder
+        self.trace = tracer
+
+    def __getattr__(self,name):
+        return getattr(self.ser,name)
+
+    def close(self):
+        self.ser.close()
+
+    def write(self,data):
+        with self.lock:
+            start = time.monotonic()
+            written = self.ser.write(data)
+            if self.trace is not None:
+                self.trace.append(serialtrace.TX,data)
+            self.stats.record(data,len(data),0,time.monotonic()-start)
+            return written
+
+    def _settimeout(self,timeout):
+        """Change the port timeout, if it changed by more than 10 ms: reconfiguring
+        the port isn't free."""
+        timeout = round(timeout,2)
+        if self.ser.timeout != timeout:
+            self.ser.timeout = timeout
+
+    def transact(self,cmd,sizes,terminator=b'#'):
+        """Send cmd and read one reply for each entry in sizes: each reply ends at
+        terminator or after its size in bytes, whichever comes first (terminator
+        None: size bytes, for binary replies such as NexStar's, whose data may
+        include the terminator byte).  A reply that doesn't arrive within the
+        port's adaptive timeout comes back short.  Returns a list of replies.
+        cmd may be a list of commands, one per reply, sent together; each is
+        then recorded in the statistics (see stats.py) on its own."""
+        with self.lock:
+            return self._transact(cmd,sizes,terminator)
+
+    def _transact(self,cmd,sizes,terminator):
+        if isinstance(cmd,(list,tuple)):
+            cmds = cmd
+            cmd = b''.join(cmds)
+        else:
+            cmds = [cmd] + [b'']*(len(sizes)-1)
+        self.ser.reset_input_buffer()
+        start = time.monotonic()
+        self.ser.write(cmd)
+        if self.trace is not None:
+            self.trace.append(serialtrace.TX,cmd)
+        replies = []
+        received = 0
+        pending = len(cmd)*self.bytetime          # time still needed to send the command
+        last = start
+        for size,sent in zip(sizes,cmds):
+            self._settimeout(self.rtt.timeout() + pending + size*self.bytetime)
+            pending = 0
+            if terminator is None:
+                reply = self.ser.read(size)
+            else:
+                reply = self.ser.read_until(terminator,size)
+            now = time.monotonic()
+            if self.trace is not None and reply:
+                self.trace.append(serialtrace.RX,reply)
+            replies.append(reply)
+            received += len(reply)
+            if len(reply) < size and (terminator is None or not reply.endswith(terminator)):
+                self.stats.record(sent,len(sent),len(reply),now-last,size)
+                for size,sent in zip(sizes[len(replies):],cmds[len(replies):]):
+                    self.stats.record(sent,len(sent),0,0.0,size)
+                self.timeouts += 1
+                self.rtt.backoff()
+                return replies + [b'']*(len(sizes)-len(replies))
+            self.stats.record(sent,len(sent),len(reply),now-last)
+            last = now
+        elapsed = time.monotonic()-start
+        self.rtt.update(max(elapsed - (len(cmd)+received)*self.bytetime,0))
+        return replies
+
+    def readreply(self,size,terminator=b'#'):
+        """Read one reply to a command that has already been sent.  See transact()."""
+        self._settimeout(self.rtt.timeout() + size*self.bytetime)
+        start = time.monotonic()
+        if terminator is None:
+            reply = self.ser.read(size)
+        else:
+            reply = self.ser.read_until(terminator,size)
+        if self.trace is not None and reply:
+            self.trace.append(serialtrace.RX,reply)
+        if len(reply) < size and (terminator is None or not reply.endswith(terminator)):
+            self.stats.record(b'',0,len(reply),time.monotonic()-start,size)
+            self.timeouts += 1
+            self.rtt.backoff()
+        else:
+            self.stats.record(b'',0,len(reply),time.monotonic()-start)
+        return reply
+
 class serialdev:
     
     def __init__(self,comport=None):
@@ -1,20 +1,77 @@
 """ A list of available serial ports on this machine.  Does file-hunting in /dev
 on Mac/Linux; does registry hacking on Windows.  Call the update method to refresh
-the list."""
+the list.
 
+On Linux, PortWatcher follows USB serial adapters being plugged in and
+unplugged, using inotify on /dev, so the list can be kept current without
+polling.  identity() names a device in a way that survives re-plugging it,
+for remembering what was found on it (see discovery.ProbeCache)."""
+
+import os
 import platform
 import itertools
+import queue
+import select
+import struct
+import threading
 
 if (platform.system() == 'Windows'):
     import winreg
 else:
     import glob
-        
+
+if (platform.system() == 'Linux'):
+    import ctypes
+    import ctypes.util
+
+BYID = '/dev/serial/by-id'
+LINUXPATTERNS = ('/dev/ttyUSB*','/dev/ttyACM*')
+
+def linux_ports():
+    """USB serial ports on Linux.  A port with a /dev/serial/by-id link is listed
+    by that name, which stays the same however many adapters are plugged in and
+    in whatever order; others by their /dev/tty name."""
+    ports = []
+    linked = set()
+    for link in sorted(glob.glob(os.path.join(BYID,'*'))):
+        ports.append(link)
+        linked.add(os.path.realpath(link))
+    for pattern in LINUXPATTERNS:
+        for device in sorted(glob.glob(pattern)):
+            if device not in linked:
+                ports.append(device)
+    return ports
+
+def identity(port):
+    """A name for the device on port that doesn't change when it is re-plugged
+    or its /dev/tty name changes: its /dev/serial/by-id name, or its USB vendor,
+    product and serial number from sysfs.  Falls back to port itself, and
+    off Linux, is port itself."""
+    if platform.system() != 'Linux':
+        return port
+    if os.path.dirname(port) == BYID:
+        return os.path.basename(port)
+    device = os.path.realpath(port)
+    for link in glob.glob(os.path.join(BYID,'*')):
+        if os.path.realpath(link) == device:
+            return os.path.basename(link)
+    path = os.path.realpath(os.path.join('/sys/class/tty',os.path.basename(device),'device'))
+    while path.startswith('/sys/devices/') and path != '/sys/devices':
+        try:
+            ids = []
+            for name in ('idVendor','idProduct','serial'):
+                with open(os.path.join(path,name)) as f:
+                    ids.append(f.read().strip())
+            return 'usb-%s:%s-%s' % tuple(ids)
+        except OSError:
+            path = os.path.dirname(path)
+    return port
+
 class Serialist(list):
     def __init__(self):
         list.__init__(self)
         self.update()
-    
+
     def update(self):
         """Update the list of active serial ports."""
         list.__init__(self)
@@ -26,7 +83,7 @@ class Serialist(list):
                 key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, path)
             except:
                 raise EnvironmentError
-            
+
             for i in itertools.count():
                 try:
                     val = winreg.EnumValue(key, i)
@@ -39,6 +96,126 @@ class Serialist(list):
             device anyway."""
             print(glob.glob('/dev/cu.*'))
             list.__init__(self,glob.glob('/dev/cu.*'))
-                    
-        """Only Windows and Mac for now.  Linux should be the same as Mac,
-        but I haven't tested it yet."""
+        elif (plat == 'Linux'):
+            """Only USB serial adapters: the /dev/ttyS*'s are mostly ports that
+            don't exist, and probing them is slow."""
+            list.__init__(self,linux_ports())
+
+# inotify(7) constants
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_DELETE_SELF = 0x400
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')       # watch, mask, cookie, name length
+
+class PortWatcher(threading.Thread):
+    """Watches for serial ports appearing and disappearing on Linux.  Each change
+    is queued as an (added, removed) pair of port lists: collect them with
+    changes(), or pass a callback, which is called with each pair from the
+    watcher's thread.  ports is the current list."""
+
+    SETTLE = 0.5        # seconds of quiet before rescanning: udev adds the by-id links after the device
+
+    def __init__(self,callback=None):
+        threading.Thread.__init__(self,name='PortWatcher',daemon=True)
+        if platform.system() != 'Linux':
+            raise OSError('Watching for serial ports needs Linux inotify.')
+        self.callback = callback
+        self.queue = queue.Queue()
+        self.ports = linux_ports()
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = (ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(),'inotify_init1 failed')
+        self.watches = {}           # watch descriptor -> directory
+        self.watch('/dev')
+        self.stoppipe = os.pipe()
+        self.start()
+
+    def watch(self,directory):
+        """Watch directory (and so the files in it), if it exists and isn't watched."""
+        if directory in self.watches.values() or not os.path.isdir(directory):
+            return
+        wd = self.add_watch(self.fd,directory.encode(),
+                            IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def stop(self):
+        os.write(self.stoppipe[1],b'x')
+        self.join(1.0)
+        os.close(self.fd)
+        for fd in self.stoppipe:
+            os.close(fd)
+
+    def changes(self):
+        """Changes since the last call, as a list of (added, removed) pairs."""
+        changes = []
+        while True:
+            try:
+                changes.append(self.queue.get_nowait())
+            except queue.Empty:
+                return changes
+
+    def events(self):
+        """Read the pending inotify events.  Returns True if any could concern a
+        serial port."""
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.fd,4096)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset < len(data):
+                wd,mask,cookie,length = INOTIFY_EVENT.unpack_from(data,offset)
+                name = data[offset+INOTIFY_EVENT.size:offset+INOTIFY_EVENT.size+length].rstrip(b'\0').decode()
+                offset += INOTIFY_EVENT.size+length
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                if mask & IN_DELETE_SELF:
+                    del self.watches[wd]
+                    relevant = True
+                elif directory == '/dev':
+                    if name == 'serial':
+                        self.watch('/dev/serial')
+                        self.watch(BYID)
+                        relevant = True
+                    elif name.startswith('ttyUSB') or name.startswith('ttyACM'):
+                        relevant = True
+                else:
+                    if name == 'by-id':
+                        self.watch(BYID)
+                    relevant = True
+
+    def run(self):
+        self.watch('/dev/serial')
+        self.watch(BYID)
+        while True:
+            ready,_,_ = select.select([self.fd,self.stoppipe[0]],[],[])
+            if self.stoppipe[0] in ready:
+                return
+            if not self.events():
+                continue
+            # Let the burst of events from one plug-in settle
+            while True:
+                ready,_,_ = select.select([self.fd,self.stoppipe[0]],[],[],self.SETTLE)
+                if self.stoppipe[0] in ready:
+                    return
+                if not ready:
+                    break
+                self.events()
+            ports = linux_ports()
+            added = [port for port in ports if port not in self.ports]
+            removed = [port for port in self.ports if port not in ports]
+            self.ports = ports
+            if added or removed:
+                self.queue.put((added,removed))
+                if self.callback is not None:
+                    self.callback(added,removed)
@@ -0,0 +1,286 @@
+""" Serial traces: a compact record of every byte sent to and received from the
+scope, kept in a fixed-size ring file, and a way to play it back.
+
+To record, give serialdev a TraceFile before opening the scope:
+
+    serialdev.tracer = serialtrace.TraceFile('scope.trace')
+
+(the UI does this when the SCOPETRACE environment variable names a file).
+Every serialdev.SerialPort then appends its traffic as frames of
+
+    8 bytes     time sent or received (double, Unix time)
+    1 byte      direction: 0 sent to the scope, 1 received from it
+    2 bytes     length of the data
+    n bytes     the data
+
+When the file is full the oldest frames are overwritten, so it never grows
+past its capacity.  To reproduce a session offline, open a driver on a
+ReplayPort: the driver's commands are answered with the recorded replies,
+after the recorded delays (divided by speed; speed None answers at once).
+
+    scope = nexstar.NexStar(serialtrace.ReplayPort('scope.trace',speed=10))
+
+replay() drives a driver through the queries of a recorded session, and
+
+    python serialtrace.py dump FILE
+    python serialtrace.py replay FILE nexstar|meade [SPEED]
+
+list a trace, or replay it and report how long each query took."""
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+TX = 0
+RX = 1
+
+MAGIC = b'SCTR'
+HEADER = struct.Struct('<4sHIIII')      # magic, version, capacity, head, tail, bytes used
+HEADERSIZE = 32
+FRAME = struct.Struct('<dBH')           # time, direction, length
+WRAP = 0xFF                             # direction of the marker where frames wrap to the start
+
+class TraceFile:
+    """A ring file of serial frames at path, holding up to capacity bytes of
+    frames.  An existing trace file is appended to; its capacity is kept."""
+
+    def __init__(self,path,capacity=1<<20):
+        self.path = path
+        self.lock = threading.Lock()
+        if not os.path.exists(path) or os.path.getsize(path) < HEADERSIZE:
+            with open(path,'wb') as f:
+                f.write(HEADER.pack(MAGIC,1,capacity,0,0,0).ljust(HEADERSIZE,b'\0'))
+                f.truncate(HEADERSIZE+capacity)
+        self.file = open(path,'r+b')
+        self.map = mmap.mmap(self.file.fileno(),0)
+        magic,version,self.capacity,self.head,self.tail,self.used = HEADER.unpack_from(self.map,0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a serial trace file' % path)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def _framesize(self,offset):
+        """Size of the frame at offset, and the offset of the next frame."""
+        if offset+FRAME.size > self.capacity:
+            return 0
+        when,direction,length = FRAME.unpack_from(self.map,HEADERSIZE+offset)
+        if direction == WRAP:
+            return 0
+        return FRAME.size+length
+
+    def _drop(self):
+        """Forget the oldest frame."""
+        size = self._framesize(self.tail)
+        if size == 0:               # wrap marker or too near the end for a frame
+            self.used -= self.capacity-self.tail
+            self.tail = 0
+        else:
+            self.tail += size
+            self.used -= size
+
+    def append(self,direction,data,when=None):
+        """Record data (bytes), sent (direction TX) or received (RX) at Unix time
+        when (default: now)."""
+        if when is None:
+            when = time.time()
+        data = bytes(data[:self.capacity//2])
+        size = FRAME.size+len(data)
+        with self.lock:
+            if self.head+size > self.capacity:
+                # No room before the end: mark the wrap, and carry on at the start
+                while self.tail > self.head or (self.used and self.tail == self.head):
+                    self._drop()
+                if self.head+FRAME.size <= self.capacity:
+                    FRAME.pack_into(self.map,HEADERSIZE+self.head,0.0,WRAP,0)
+                self.used += self.capacity-self.head
+                self.head = 0
+            while self.used and self.tail >= self.head and self.tail < self.head+size:
+                self._drop()
+            FRAME.pack_into(self.map,HEADERSIZE+self.head,when,direction,len(data))
+            self.map[HEADERSIZE+self.head+FRAME.size:HEADERSIZE+self.head+size] = data
+            self.head += size
+            self.used += size
+            HEADER.pack_into(self.map,0,MAGIC,1,self.capacity,self.head,self.tail,self.used)
+
+    def frames(self):
+        """The frames in the file, oldest first, as (time, direction, data)."""
+        with self.lock:
+            offset,used = self.tail,self.used
+            frames = []
+            while used > 0:
+                size = self._framesize(offset)
+                if size == 0:
+                    used -= self.capacity-offset
+                    offset = 0
+                    continue
+                when,direction,length = FRAME.unpack_from(self.map,HEADERSIZE+offset)
+                start = HEADERSIZE+offset+FRAME.size
+                frames.append((when,direction,bytes(self.map[start:start+length])))
+                offset += size
+                used -= size
+        return frames
+
+class ReplayPort:
+    """A stand-in for serialdev.SerialPort that answers from the trace at path.
+    Each command the driver sends is matched to the next recorded send of the
+    same bytes, and the data received after it becomes the reply.  Commands not
+    in the trace get no reply; they are counted in misses."""
+
+    LOOKAHEAD = 64      # frames searched for a command that doesn't come next
+
+    def __init__(self,path,speed=1.0):
+        trace = TraceFile(path)
+        self.frames = trace.frames()
+        trace.close()
+        self.speed = speed
+        self.position = 0           # next frame to match
+        self.buffer = b''           # replies received and not yet read
+        self.ready = []             # times the bytes in buffer arrive, one per frame
+        self.timeouts = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def close(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        self.buffer = b''
+
+    flushInput = reset_input_buffer
+
+    @property
+    def done(self):
+        """True when every recorded frame has been played."""
+        return self.position >= len(self.frames)
+
+    def nextcommand(self):
+        """The next recorded command, or None at the end of the trace."""
+        for when,direction,data in self.frames[self.position:]:
+            if direction == TX:
+                return data
+        return None
+
+    def _send(self,cmd):
+        """Match cmd against the trace and queue the replies recorded after it."""
+        end = min(self.position+self.LOOKAHEAD,len(self.frames))
+        for i in range(self.position,end):
+            when,direction,data = self.frames[i]
+            if direction == TX and data == cmd:
+                break
+        else:
+            self.misses += 1
+            return
+        sent = when
+        start = time.monotonic()
+        i += 1
+        while i < len(self.frames) and self.frames[i][1] != TX:
+            when,direction,data = self.frames[i]
+            if self.speed:
+                delay = (when-sent)/self.speed - (time.monotonic()-start)
+                if delay > 0:
+                    time.sleep(delay)
+            self.buffer += data
+            i += 1
+        self.position = i
+
+    def write(self,data):
+        with self.lock:
+            self._send(bytes(data))
+            return len(data)
+
+    def _take(self,size,terminator):
+        if terminator is None or terminator not in self.buffer[:size]:
+            end = size
+        else:
+            end = self.buffer.index(terminator)+1
+        reply,self.buffer = self.buffer[:end],self.buffer[end:]
+        return reply
+
+    def transact(self,cmd,sizes,terminator=b'#'):
+        """Like serialdev.SerialPort.transact(), answered from the trace."""
+        if isinstance(cmd,(list,tuple)):
+            cmd = b''.join(cmd)
+        with self.lock:
+            self.buffer = b''
+            self._send(cmd)
+            replies = []
+            for size in sizes:
+                reply = self._take(size,terminator)
+                replies.append(reply)
+                if len(reply) < size and (terminator is None or not reply.endswith(terminator)):
+                    self.timeouts += 1
+                    return replies + [b'']*(len(sizes)-len(replies))
+            return replies
+
+    def readreply(self,size,terminator=b'#'):
+        with self.lock:
+            reply = self._take(size,terminator)
+            if len(reply) < size and (terminator is None or not reply.endswith(terminator)):
+                self.timeouts += 1
+            return reply
+
+    def read(self,size):
+        with self.lock:
+            return self._take(size,None)
+
+# The driver method that sends each recorded query, for replay()
+QUERIES = {b'e':'getposition', b'z':'getaltaz', b't':'is_safe',
+           b':GR#:GD#':'getposition', b':GZ#:GA#':'getaltaz', b':GW#':'is_safe',
+           b':GR#:GD#:GW#:GZ#:GA#':'status', b':GVN#':'getversion'}
+
+def replay(scope):
+    """Drive scope, a driver opened on a ReplayPort, through the queries of the
+    recorded session after its opening greetings, in order.  Commands that
+    aren't queries are sent as they were recorded.  Returns a list of
+    (command, seconds, result)."""
+    port = scope.ser
+    results = []
+    while not port.done:
+        cmd = port.nextcommand()
+        if cmd is None:
+            break
+        method = QUERIES.get(cmd)
+        start = time.perf_counter()
+        if method is None:
+            port.write(cmd)
+            result = None
+        elif method == 'is_safe':
+            result = scope.is_safe(refresh=True)
+        else:
+            result = getattr(scope,method)()
+        results.append((cmd,time.perf_counter()-start,result))
+    return results
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'dump':
+        trace = TraceFile(sys.argv[2])
+        frames = trace.frames()
+        start = frames[0][0] if frames else 0
+        for when,direction,data in frames:
+            print('%10.3f %s %r' % (when-start,('>','<')[direction],data))
+        trace.close()
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'replay':
+        import meade
+        import nexstar
+        speed = float(sys.argv[4]) if len(sys.argv) > 4 else 1.0
+        port = ReplayPort(sys.argv[2],speed=speed or None)
+        if sys.argv[3].lower() == 'nexstar':
+            scope = nexstar.NexStar(port)
+        else:
+            scope = meade.Meade(port)
+        results = replay(scope)
+        for cmd,seconds,result in results:
+            print('%-24r %8.2f ms  %s' % (cmd,seconds*1000,result))
+        print('%d commands replayed, %d not in the trace, %d timeouts.' %
+              (len(results),port.misses,port.timeouts))
+    else:
+        print('Usage: python serialtrace.py dump FILE')
+        print('       python serialtrace.py replay FILE nexstar|meade [SPEED]')
@@ -0,0 +1,77 @@
+""" StateShadow: the drivers' record of the scope settings they last set or
+saw (slew rate, tracking, precision mode, focuser speed...), so that commands
+which wouldn't change anything are never sent.
+
+A setting is unknown until a command sets it or a query reports it.  If a query
+reports something different from the shadow, the shadow takes the scope's word
+for it and counts a resync.  Settings the handset could change behind our back
+are only trusted until the next explicit query."""
+
+import threading
+
+class StateShadow:
+
+    def __init__(self):
+        self.state = {}
+        self.lock = threading.Lock()
+        self.saved = 0          # commands not sent because they'd change nothing
+        self.resyncs = 0        # queries that contradicted the shadow
+
+    def known(self,key):
+        """True if setting key is known."""
+        return key in self.state
+
+    def get(self,key,default=None):
+        return self.state.get(key,default)
+
+    def needed(self,key,value):
+        """True if setting key to value would change anything, so the command
+        must be sent.  Otherwise counts a saved command."""
+        with self.lock:
+            if key in self.state and self.state[key] == value:
+                self.saved += 1
+                return False
+            return True
+
+    def acknowledge(self,key,value):
+        """The scope has accepted setting key to value."""
+        with self.lock:
+            self.state[key] = value
+
+    def observe(self,key,value):
+        """A query says setting key is value.  Returns False if that contradicts
+        the shadow (which is then corrected)."""
+        with self.lock:
+            agrees = self.state.get(key,value) == value
+            if not agrees:
+                self.resyncs += 1
+            self.state[key] = value
+            return agrees
+
+    def recall(self,key):
+        """Value of setting key if known, counting a query saved; None if not."""
+        with self.lock:
+            if key not in self.state:
+                return None
+            self.saved += 1
+            return self.state[key]
+
+    def toggled(self,key,value):
+        """A toggle command reports setting key is now value.  Counts a resync if
+        that isn't the opposite of what the shadow had."""
+        with self.lock:
+            if key in self.state and self.state[key] == value:
+                self.resyncs += 1
+            self.state[key] = value
+
+    def forget(self,key=None):
+        """Setting key (default: every setting) is no longer known."""
+        with self.lock:
+            if key is None:
+                self.state.clear()
+            else:
+                self.state.pop(key,None)
+
+    def report(self):
+        """A one-line summary of the commands saved."""
+        return 'State shadow: %d commands saved, %d resyncs.' % (self.saved,self.resyncs)
@@ -0,0 +1,205 @@
+""" Per-command statistics for the serial link: how often each command is sent,
+how many bytes go each way, how long the round trips take, and how often the
+scope fails to answer.
+
+serialdev.SerialPort records every exchange in the module's recorder; the
+drivers add the replies they can't make sense of.  Read the numbers with
+
+    stats.recorder.snapshot()       # dict of command -> dict of figures
+    print(stats.recorder.report())  # table, most serial time first
+
+or over HTTP, after stats.serve(), at http://127.0.0.1:8765/ (text) and
+http://127.0.0.1:8765/stats.json.
+
+Commands pipelined in one burst are timed from the reply before theirs, so
+the burst's time is shared out among them rather than counted twice.
+
+Recording takes no lock: each thread keeps its own table, which only it
+writes, and readers add the tables up.  A snapshot taken while commands are
+being recorded may be off by the command in progress.  When a thread ends,
+its table is folded into a shared one for finished threads, so short-lived
+threads (broker connections, probe workers) don't pile up tables."""
+
+import http.server
+import json
+import threading
+import weakref
+
+# Round-trip histogram bucket upper bounds, in milliseconds
+BUCKETS = (1,2,5,10,20,50,100,200,500,1000,2000,5000,float('inf'))
+
+# Slots in each command's entry
+COUNT,SENT,RECEIVED,SECONDS,TIMEOUTS,SHORT,ERRORS,HISTOGRAM = range(8)
+
+def opcode(cmd):
+    """Name of the command cmd (bytes) for the statistics: the NexStar opcode
+    (with axis and message ID for passthrough commands, e.g. 'P16/36'), or the
+    Meade command without its arguments (e.g. ':Sr', ':GVN', ':F+')."""
+    if not cmd:
+        return 'reply'
+    if cmd[0:1] == b':':
+        name = cmd[:3]
+        if cmd[3:4].isalpha():
+            name = cmd[:4]
+        return name.rstrip(b'#').decode('ascii','replace')
+    if cmd[0:1] == b'P' and len(cmd) >= 4:
+        return 'P%d/%d' % (cmd[2],cmd[3])
+    return cmd[0:1].decode('ascii','replace')
+
+def newentry():
+    return [0,0,0,0.0,0,0,0,[0]*len(BUCKETS)]
+
+def add(total,entry,sign=1):
+    """Add entry into total (subtract, for sign=-1)."""
+    for i in range(HISTOGRAM):
+        total[i] += sign*entry[i]
+    total[HISTOGRAM] = [a+sign*b for a,b in zip(total[HISTOGRAM],entry[HISTOGRAM])]
+
+class Owner:
+    """Held in a recording thread's local storage, and so dropped when the
+    thread ends; that retires the thread's table (see Recorder)."""
+
+def bucket(ms):
+    for i,bound in enumerate(BUCKETS):
+        if ms <= bound:
+            return i
+
+class Recorder:
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()    # for readers and retiring tables, not recording
+        self.tables = []        # one {opcode: entry} per live recording thread
+        self.finished = {}      # the tables of threads that have ended, added up
+        self.baseline = {}      # totals at the last reset()
+
+    def _entry(self,name):
+        try:
+            table = self.local.table
+        except AttributeError:
+            table = self._newtable()
+        entry = table.get(name)
+        if entry is None:
+            entry = table[name] = newentry()
+        return entry
+
+    def _newtable(self):
+        table = self.local.table = {}
+        self.local.owner = Owner()
+        weakref.finalize(self.local.owner,self._retire,table)
+        with self.lock:
+            self.tables.append(table)
+        return table
+
+    def _retire(self,table):
+        """A recording thread has ended: fold its table into finished."""
+        with self.lock:
+            for name,entry in table.items():
+                add(self.finished.setdefault(name,newentry()),entry)
+            self.tables = [t for t in self.tables if t is not table]
+
+    def record(self,cmd,sent,received,seconds,expected=None):
+        """Record an exchange of command cmd: sent and received bytes, taking
+        seconds.  If expected (the reply length wanted) is given, a reply of
+        received < expected bytes counts as a timeout if empty, a short read if
+        not."""
+        entry = self._entry(opcode(cmd))
+        entry[COUNT] += 1
+        entry[SENT] += sent
+        entry[RECEIVED] += received
+        entry[SECONDS] += seconds
+        entry[HISTOGRAM][bucket(seconds*1000)] += 1
+        if expected is not None and received < expected:
+            entry[TIMEOUTS if received == 0 else SHORT] += 1
+
+    def error(self,cmd):
+        """Record that the scope's reply to command cmd made no sense."""
+        self._entry(opcode(cmd))[ERRORS] += 1
+
+    def totals(self):
+        """Every thread's entries added up, as {opcode: entry}."""
+        totals = {}
+        with self.lock:
+            for table in [self.finished]+self.tables:
+                for name,entry in list(table.items()):
+                    total = totals.get(name)
+                    if total is None:
+                        total = totals[name] = newentry()
+                    add(total,entry)
+        for name,base in self.baseline.items():
+            add(totals[name],base,-1)
+        return totals
+
+    def reset(self):
+        """Start counting from zero again."""
+        self.baseline = {}
+        self.baseline = self.totals()
+
+    def snapshot(self):
+        """Figures for each command: count, bytes sent and received, total and
+        mean round trip time, timeouts, short reads, errors, 50th/90th/99th
+        percentile round trip (upper bound of its histogram bucket, ms) and the
+        histogram itself, as {bucket bound ms: count}."""
+        snapshot = {}
+        for name,entry in self.totals().items():
+            count = entry[COUNT]
+            if count == 0 and entry[ERRORS] == 0:
+                continue
+            figures = dict(count=count,sent=entry[SENT],received=entry[RECEIVED],
+                           seconds=entry[SECONDS],mean_ms=entry[SECONDS]*1000/count if count else 0.0,
+                           timeouts=entry[TIMEOUTS],short=entry[SHORT],errors=entry[ERRORS])
+            histogram = entry[HISTOGRAM]
+            for p in (50,90,99):
+                figures['p%d_ms' % p] = None
+                seen = 0
+                for bound,n in zip(BUCKETS,histogram):
+                    seen += n
+                    if count and seen >= count*p/100:
+                        figures['p%d_ms' % p] = bound if bound != float('inf') else None
+                        break
+            figures['histogram'] = dict((str(bound),n) for bound,n in zip(BUCKETS,histogram) if n)
+            snapshot[name] = figures
+        return snapshot
+
+    def report(self):
+        """The snapshot as a text table, the commands using most serial time first."""
+        snapshot = self.snapshot()
+        lines = ['%-8s %7s %8s %8s %9s %8s %6s %6s %6s %6s' %
+                 ('command','count','sent','received','seconds','mean ms','p90','tmout','short','errors')]
+        for name,f in sorted(snapshot.items(),key=lambda item: -item[1]['seconds']):
+            lines.append('%-8s %7d %8d %8d %9.3f %8.2f %6s %6d %6d %6d' %
+                         (name,f['count'],f['sent'],f['received'],f['seconds'],f['mean_ms'],
+                          f['p90_ms'],f['timeouts'],f['short'],f['errors']))
+        return '\n'.join(lines)
+
+recorder = Recorder()
+
+class StatsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/stats.json':
+            body = json.dumps(self.server.recorder.snapshot(),indent=1).encode()
+            kind = 'application/json'
+        elif self.path == '/':
+            body = (self.server.recorder.report()+'\n').encode()
+            kind = 'text/plain'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type',kind)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):
+        pass
+
+def serve(port=8765,host='127.0.0.1',recorder=recorder):
+    """Serve recorder's statistics over HTTP from a background thread.  Returns
+    the server; call its shutdown() to stop."""
+    server = http.server.ThreadingHTTPServer((host,port),StatsHandler)
+    server.daemon_threads = True
+    server.recorder = recorder
+    threading.Thread(target=server.serve_forever,name='StatsServer',daemon=True).start()
+    return server
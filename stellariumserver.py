@@ -1,116 +1,244 @@
 import struct
 import socket
-import select
+import selectors
 import time
 
 import radec
-     
+
+LENGTH = struct.Struct('<H')
+GOTOMESSAGE = struct.Struct('<HHQIi')     # length, type, microseconds since epoch, RA, dec
+STATUSMESSAGE = struct.Struct('<HHQIiI')  # length, type, microseconds since epoch, RA, dec, status
+SENDBUFFER = 4096         # small kernel send buffers, so stale positions can't pile up there either
+
+class Connection:
+     """ One client connected to the GOTO or SYNC port: its socket, what it has
+     sent that isn't a whole message yet, and what is waiting to go to it.
+
+     Outgoing, a client holds at most two messages: the rest of the one being
+     written (which must be finished, or the client loses the framing), and
+     the newest one not yet started.  A newer position replaces a waiting
+     one, so a slow client just gets fewer, fresher positions."""
+
+     def __init__(self,sock,address,kind):
+          self.sock = sock
+          self.address = address
+          self.kind = kind          # 'GOTO' or 'SYNC'
+          self.inbuf = bytearray()
+          self.sending = memoryview(b'')     # rest of the message being written
+          self.latest = None                 # newest message not started yet
+
+     def waiting(self):
+          """True if there is anything still to write."""
+          return bool(self.sending) or self.latest is not None
+
 class StellariumServer:
      """ TCP/IP interface to send and receive information from Stellarium, a
-     planetarium program http://www.stellarium.org/"""
-
-     def __init__(self):
-          """Open two TCP/IP sockets, one for GOTO commands from Stellarium
-          (port 10001), one for SYNC commands (port 10002)"""
-
-          TCP_IP = '127.0.0.1'
-          GOTO_PORT = 10001
-          SYNC_PORT = 10002
-          BUFFER_SIZE = 1024
-     
-          self.gotoport = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-          self.gotoport.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-          self.gotoport.bind((TCP_IP, GOTO_PORT))
-          self.gotoport.setblocking(0)
-          self.gotoport.listen(1)
-     
-          self.syncport = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-          self.syncport.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-          self.syncport.bind((TCP_IP, SYNC_PORT))
-          self.syncport.setblocking(0)
-          self.syncport.listen(1)
-     
-          self.socklist = [self.gotoport,self.syncport]
-          self.gotoportlist = []
-          self.syncportlist = []
+     planetarium program http://www.stellarium.org/
+
+     Event driven: a selector watches the listening sockets and every
+     connection, so each receive() only handles the sockets that are ready.
+     Sends go to each connection's output buffer, and are written as the
+     socket can take them; a connection only asks to be woken for writing
+     while it has something waiting."""
+
+     def __init__(self,host='127.0.0.1',gotoport=10001,syncport=10002,backlog=16,selector=None,log=print):
+          """Listen on host (a name or address, IPv4 or IPv6, resolved with
+          getaddrinfo(); '' for every IPv4 interface, so planetariums on other
+          machines can connect) for GOTO commands from Stellarium on port
+          gotoport, and SYNC commands on port syncport.  Port 0 picks a free
+          port; see addresses().  Clients connecting and leaving are reported
+          with log(message), e.g. a log.Log widget's log method.
+
+          Several servers can share one selector, and so one event loop (see
+          multiscope.py); the loop then passes each server its own events
+          through handle(), instead of calling receive()."""
+
+          self.selector = selector if selector is not None else selectors.DefaultSelector()
+          self.ownselector = selector is None
+          self.log = log
+          self.listeners = {}
+          for kind,port in (('GOTO',gotoport),('SYNC',syncport)):
+               family,type,proto,_,address = socket.getaddrinfo(host or None,port,
+                                                                 socket.AF_INET if host == '' else socket.AF_UNSPEC,
+                                                                 socket.SOCK_STREAM,0,socket.AI_PASSIVE)[0]
+               listener = socket.socket(family,type,proto)
+               listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+               listener.bind(address)
+               listener.setblocking(0)
+               listener.listen(backlog)
+               self.listeners[kind] = listener
+               self.selector.register(listener,selectors.EVENT_READ,(self,kind))
+          self.gotoport = self.listeners['GOTO']
+          self.syncport = self.listeners['SYNC']
+          self.connections = []
+          self.ignored = 0         # messages of types we don't handle
+          self.resyncs = 0         # bytes thrown away to find the next message
+          self.coalesced = 0       # position reports replaced by newer ones before being sent
+
+     def addresses(self):
+          """(host, port) addresses of the GOTO and SYNC sockets."""
+          return self.gotoport.getsockname()[:2],self.syncport.getsockname()[:2]
+
+     def clients(self,kind='GOTO'):
+          """Connections to the GOTO or SYNC port."""
+          return [conn for conn in self.connections if conn.kind == kind]
+
+     def close(self):
+          for conn in list(self.connections):
+               self.disconnect(conn)
+          for listener in self.listeners.values():
+               self.selector.unregister(listener)
+               listener.close()
+          self.listeners = {}
+          if self.ownselector:
+               self.selector.close()
 
      def receive(self):
-          """Listen for incoming connections and data sent from Stellarium.
-          Non-blocking I/O."""
+          """Listen for incoming connections and data sent from Stellarium, and
+          write what's waiting to go out.  Non-blocking I/O.  Reads everything
+          each connection has sent, and returns the last GOTO and SYNC
+          positions among it, as (gotopos, syncpos); None for either if none
+          came."""
           syncpos = None
           gotopos = None
-          """Dude I totally learned how select() works!"""
-          ready_to_read, ready_to_write, in_error = select.select(self.socklist,self.socklist,self.socklist,0)  # Non-blocking read
-          if (ready_to_read):  # Some sockets want attention
-               for sok in ready_to_read:
-                    if (sok is self.gotoport):   #Master goto port connection
-                         conn, addr = sok.accept()
-                         print('Connection address:', addr)
-                         self.socklist.append(conn)
-                         self.gotoportlist.append(conn)
-                    elif (sok is self.syncport):  #Master sync port connection
-                         conn, addr = sok.accept()
-                         print('Connection address:', addr)
-                         self.socklist.append(conn)
-                         self.syncportlist.append(conn)
-                    else:  # it's an accepted connection
-                         data = sok.recv(2)
-                         if not data: 
-                              print('closing connection')
-                              self.socklist.remove(sok)                    
-                              if sok in self.gotoportlist:
-                                   self.gotoportlist.remove(sok)
-                              if sok in self.syncportlist:
-                                   self.syncportlist.remove(sok)                                   
-                              sok.close()
-                         else:
-                              """Stellarium data format:
-                              2 bytes (length of message)
-                              2 bytes (short int, message type)
-                              8 bytes (long long int, microseconds since epoch)
-                              4 bytes (unsigned int, right ascension)
-                              4 bytes (signed int, declination)"""
-                              
-                              leng = struct.unpack('<H',data)[0]
-                              if (leng == 20):
-                                   stelltype = sok.recv(2)
-                                   stelltime = sok.recv(8)
-                                   stellrab  = sok.recv(4)
-                                   stelldecb = sok.recv(4)
-                                   print(stelltype+stelltime+stellrab+stelldecb)
-                                   stellra   = struct.unpack('<I',stellrab)[0]
-                                   stelldec  = struct.unpack('<i',stelldecb)[0]
-                                   stellpos = radec.RADec.fromStellarium(stellra,stelldec)
-                                   if sok in self.gotoportlist:
-                                        gotopos = stellpos
-                                   elif sok in self.syncportlist:
-                                        syncpos = stellpos
-                                   else:
-                                        print("Not sure whether to sync or goto.")
-                              else:
-                                   print("Stellarium says it's sending ",leng,"bytes.  I don't even...")               
+          for key,events in self.selector.select(0):
+               server,target = key.data
+               if server is not self:
+                    continue
+               stellpos = self.handle(target,events)
+               if stellpos is not None:
+                    if target.kind == 'GOTO':
+                         gotopos = stellpos
+                    else:
+                         syncpos = stellpos
           return gotopos,syncpos
-     
+
+     def handle(self,target,events):
+          """Deal with selector events on target: a listening socket's kind
+          ('GOTO' or 'SYNC'), or a Connection.  Returns the position in the last
+          message read from a connection, or None; the connection's kind says
+          whether it is a GOTO or a SYNC."""
+          if isinstance(target,str):
+               self.accept(self.listeners[target],target)
+               return None
+          if events & selectors.EVENT_WRITE:
+               self.flush(target)
+          if events & selectors.EVENT_READ and target in self.connections:
+               return self.read(target)
+          return None
+
+     def accept(self,listener,kind):
+          """Accept every connection waiting on listener."""
+          while True:
+               try:
+                    sock, addr = listener.accept()
+               except (BlockingIOError,InterruptedError):
+                    return
+               self.log('Stellarium connected from %s (%s port)' % (addr[0],kind))
+               sock.setblocking(0)
+               sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SENDBUFFER)
+               conn = Connection(sock,addr,kind)
+               self.connections.append(conn)
+               self.selector.register(sock,selectors.EVENT_READ,(self,conn))
+
+     def read(self,conn):
+          """Read what conn has sent.  Returns the position in the last whole
+          GOTO message, or None."""
+          try:
+               data = conn.sock.recv(4096)
+          except (BlockingIOError,InterruptedError):
+               return None
+          except OSError:
+               data = b''
+          if not data:
+               self.log('Stellarium at %s disconnected' % (conn.address[0],))
+               self.disconnect(conn)
+               return None
+          conn.inbuf += data
+          return self.extract(conn.inbuf)
+
+     def extract(self,buf):
+          """Take every whole message off the front of bytearray buf.  Returns
+          the position in the last GOTO message, or None.
+
+          Stellarium data format:
+          2 bytes (length of message)
+          2 bytes (short int, message type)
+          8 bytes (long long int, microseconds since epoch)
+          4 bytes (unsigned int, right ascension)
+          4 bytes (signed int, declination)
+
+          Stellarium sends nothing else, so any other length means the stream
+          has lost its framing: bytes are dropped one at a time until a message
+          starts again.  Messages of other types are skipped."""
+          stellpos = None
+          offset = 0
+          while len(buf)-offset >= LENGTH.size:
+               leng, = LENGTH.unpack_from(buf,offset)
+               if leng != GOTOMESSAGE.size:
+                    offset += 1
+                    self.resyncs += 1
+                    continue
+               if len(buf)-offset < leng:
+                    break
+               leng,stelltype,stelltime,stellra,stelldec = GOTOMESSAGE.unpack_from(buf,offset)
+               if stelltype == 0:
+                    stellpos = (stellra,stelldec)
+               else:
+                    self.ignored += 1
+               offset += leng
+          del buf[:offset]
+          if stellpos is None:
+               return None
+          return radec.RADec.fromStellarium(*stellpos)
+
+     def disconnect(self,conn):
+          self.connections.remove(conn)
+          self.selector.unregister(conn.sock)
+          conn.sock.close()
+
+     def flush(self,conn):
+          """Write as much of conn's waiting messages as its socket will take,
+          and ask to be woken when it can take more, if there is more."""
+          while True:
+               if not conn.sending:
+                    if conn.latest is None:
+                         break
+                    conn.sending = memoryview(conn.latest)
+                    conn.latest = None
+               try:
+                    sent = conn.sock.send(conn.sending)
+               except (BlockingIOError,InterruptedError):
+                    break
+               except OSError:
+                    self.disconnect(conn)
+                    return
+               conn.sending = conn.sending[sent:]
+               if conn.sending:          # socket is full
+                    break
+          events = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.waiting() else 0)
+          if self.selector.get_key(conn.sock).events != events:
+               self.selector.modify(conn.sock,events,(self,conn))
+
      def send(self,pos,type='GOTO'):
-          if len(self.gotoportlist) > 0:
+          """Report telescope position pos to the clients on the GOTO port (or
+          the SYNC port, for type='SYNC').  The message is encoded once and
+          shared by every client; one that isn't keeping up has its unsent
+          report replaced (see Connection), and never holds up the others."""
+          clients = self.clients(type)
+          if clients:
                stellpos = pos.toStellarium()
                """ compose message.  Stellarium data format:
                2bytes              # bytes in msg
-               2bytes              type = 0 
+               2bytes              type = 0
                8bytes              Time (microseconds since epoch)
                4bytes              RA
                4bytes              Dec
                4bytes              Status (0 = OK)"""
-               bytestream = struct.pack('<H',0) + \
-                          struct.pack('<Q',int(time.time()*1e6))+\
-                          struct.pack('<I',stellpos[0])+\
-                          struct.pack('<i',stellpos[1])+\
-                          struct.pack('<I',0)                            
-               bytestream = struct.pack('<H',len(bytestream)+2)+bytestream  # prepend length
-               if type=='SYNC':
-                    ready_to_read, ready_to_write, in_error = select.select(self.syncportlist,self.syncportlist,self.syncportlist,0)
-               else:
-                    ready_to_read, ready_to_write, in_error = select.select(self.gotoportlist,self.gotoportlist,self.gotoportlist,0)
-               for sok in ready_to_write:
-                    sok.send(bytestream)
-     
+               bytestream = STATUSMESSAGE.pack(STATUSMESSAGE.size,0,int(time.time()*1e6),
+                                               stellpos[0],stellpos[1],0)
+               for conn in clients:
+                    if conn.latest is not None:
+                         self.coalesced += 1
+                    conn.latest = bytestream
+                    self.flush(conn)
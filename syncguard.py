@@ -0,0 +1,34 @@
+""" SyncGuard: the checks a SYNC from Stellarium must pass before it is sent to
+the scope.  A SYNC redefines where the mount thinks it is pointing, so a stray
+click shouldn't be enough:
+
+  - the scope must be able to sync at all (Meade drivers can't; see CANSYNC);
+  - the position must be in the northern hemisphere (NexStar syncs south of the
+    equator go wrong: blame Celestron);
+  - it must be confirmed by a second SYNC within window seconds of the first.
+
+The UI and multiscope's feeds each keep one per scope."""
+
+import time
+
+class SyncGuard:
+
+    def __init__(self,window=10.0,clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self.asked = None       # when the SYNC awaiting confirmation came in
+
+    def check(self,scope,pos):
+        """Stellarium asks scope to SYNC on RADec pos.  Returns (sync, message):
+        sync is True if pos should be sent to the scope now; message, if not
+        None, is what to tell the user."""
+        if not scope.CANSYNC:
+            return (False,"Can't sync this telescope.")
+        if pos.dec() < 0:
+            return (False,"Can't sync to southern hemisphere.  Blame Celestron.")
+        now = self.clock()
+        if self.asked is None or now-self.asked > self.window:
+            self.asked = now
+            return (False,"Confirm SYNC: make sure telescope is centered on Stellarium's target, and SYNC again.")
+        self.asked = None
+        return (True,None)
@@ -0,0 +1,62 @@
+""" Round trips through the broker, against an emulated NexStar.
+
+    python -m unittest test_broker      (or pytest)"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+import broker
+import emulator
+import nexstar
+import radec
+
+class BrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emulator = emulator.NexStarEmulator(emulator.Mount(3.0,20.0))
+        self.scope = nexstar.NexStar(self.emulator.port)
+        self.assertTrue(self.scope.ready)
+        self.path = os.path.join(tempfile.mkdtemp(),'broker.sock')
+        self.server = broker.BrokerServer(broker.Broker(self.scope),self.path)
+        threading.Thread(target=self.server.serve_forever,daemon=True).start()
+        self.client = broker.BrokerClient(self.path)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.scope.close()
+        self.emulator.close()
+        os.rmdir(os.path.dirname(self.path))
+
+    def test_goto_radec(self):
+        target = radec.RADec((5.5,40.0))
+        self.client.goto(target)
+        ra,dec = self.emulator.mount.target
+        self.assertAlmostEqual(ra,5.5,places=5)
+        self.assertAlmostEqual(dec,40.0,places=5)
+
+    def test_sync_and_getposition(self):
+        self.client.sync(radec.RADec((7.25,-10.0)))
+        pos = self.client.getposition()
+        self.assertIsInstance(pos,radec.RADec)
+        self.assertAlmostEqual(pos[0],7.25,places=5)
+        self.assertAlmostEqual(pos[1],-10.0,places=5)
+
+    def test_ready(self):
+        self.assertTrue(self.client.ready)
+        self.scope.ready = False
+        self.assertFalse(self.client.ready)
+
+    def test_refuses_live_socket(self):
+        with self.assertRaises(OSError):
+            broker.BrokerServer(broker.Broker(self.scope),self.path)
+        self.assertTrue(self.client.ready)      # the first broker still works
+
+    def test_socket_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777,0o600)
+
+if __name__ == '__main__':
+    unittest.main()